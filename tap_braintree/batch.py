@@ -0,0 +1,83 @@
+"""Files of records announced to the target with Singer BATCH messages."""
+import gzip
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+from tap_braintree.output import dumps, orjson
+
+ENCODING = {"format": "jsonl", "compression": "gzip"}
+
+
+class BatchFile:
+    def __init__(self, path: Path):
+        self.path = path
+        self.records = 0
+        self._file = gzip.open(path, "wb", compresslevel=1)
+
+    def write(self, line: bytes):
+        self._file.write(line)
+        self.records += 1
+
+    def close(self):
+        self._file.close()
+
+
+class BatchWriter:
+    """Writes the records of a stream to gzipped JSON Lines files.
+
+    Records are written to one file per stream, or stream map alias, until
+    the file holds max_records records. take_messages closes the open files
+    and returns a BATCH message per stream with the files written since the
+    last call, which the stream writes before each STATE message, so every
+    bookmark covers only records of files already announced.
+
+    Records are encoded with orjson when it is installed, unless
+    exact_decimals is set, the same as the RECORD messages of fast_output.
+    """
+
+    def __init__(self, directory, max_records=None, exact_decimals=False):
+        self.directory = Path(directory)
+        self.max_records = max_records
+        self.fast_encoder = orjson is not None and not exact_decimals
+        self._open: Dict[str, BatchFile] = {}
+        self._written: Dict[str, List[BatchFile]] = {}
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def write(self, stream: str, record: dict):
+        batch = self._open.get(stream)
+        if batch is None:
+            path = self.directory / f"{stream}-{uuid.uuid4().hex}.jsonl.gz"
+            batch = self._open[stream] = BatchFile(path)
+        batch.write(dumps(record, self.fast_encoder))
+        if self.max_records and batch.records >= self.max_records:
+            self._close(stream)
+
+    def _close(self, stream: str):
+        batch = self._open.pop(stream)
+        batch.close()
+        self._written.setdefault(stream, []).append(batch)
+
+    def take_messages(self) -> List[dict]:
+        for stream in list(self._open):
+            self._close(stream)
+        messages = [
+            {
+                "type": "BATCH",
+                "stream": stream,
+                "encoding": ENCODING,
+                "manifest": [batch.path.resolve().as_uri() for batch in batches],
+            }
+            for stream, batches in self._written.items()
+        ]
+        self._written = {}
+        return messages
+
+    def discard(self):
+        """Close and delete the files not announced yet."""
+        for name in list(self._open):
+            self._close(name)
+        for batches in self._written.values():
+            for batch in batches:
+                batch.path.unlink()
+        self._written = {}
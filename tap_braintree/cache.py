@@ -0,0 +1,102 @@
+"""Customer address cache used by the transactions billing backfill."""
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+Address = Optional[Tuple[Optional[str], Optional[str]]]
+
+
+class CustomerAddressCache:
+    """Bounded LRU cache of customer_id -> (country_code_alpha2, region).
+
+    A cached value of None records that the customer was not found or has no
+    address with a country, so those customers aren't looked up again. When a
+    path is given, entries are also persisted to a SQLite file and reused by
+    later runs until they are older than ttl_hours. Entries become visible to
+    other runs on commit, which the stream calls after every prefetch batch,
+    and on close.
+    """
+
+    MISSING = object()
+
+    def __init__(self, max_size=10000, path=None, ttl_hours=24 * 7):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_hours * 3600
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Address]" = OrderedDict()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(str(path))
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS customer_addresses ("
+                "customer_id TEXT PRIMARY KEY, found INTEGER, "
+                "country_code_alpha2 TEXT, region TEXT, fetched_at REAL)"
+            )
+
+    def __contains__(self, customer_id):
+        return self._lookup(customer_id) is not self.MISSING
+
+    def get(self, customer_id):
+        """Return the cached address, None for a negative entry, or MISSING."""
+        address = self._lookup(customer_id)
+        if address is self.MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return address
+
+    def set(self, customer_id, address: Address):
+        self._remember(customer_id, address)
+        if self._db is not None:
+            country_code_alpha2, region = address or (None, None)
+            self._db.execute(
+                "INSERT OR REPLACE INTO customer_addresses VALUES (?, ?, ?, ?, ?)",
+                (
+                    customer_id,
+                    address is not None,
+                    country_code_alpha2,
+                    region,
+                    time.time(),
+                ),
+            )
+
+    def commit(self):
+        if self._db is not None:
+            self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.execute(
+                "DELETE FROM customer_addresses WHERE fetched_at < ?",
+                (time.time() - self.ttl_seconds,),
+            )
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def _lookup(self, customer_id):
+        if customer_id in self._entries:
+            self._entries.move_to_end(customer_id)
+            return self._entries[customer_id]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT found, country_code_alpha2, region FROM customer_addresses "
+                "WHERE customer_id = ? AND fetched_at >= ?",
+                (customer_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+            if row is not None:
+                found, country_code_alpha2, region = row
+                address = (country_code_alpha2, region) if found else None
+                self._remember(customer_id, address)
+                return address
+
+        return self.MISSING
+
+    def _remember(self, customer_id, address: Address):
+        self._entries[customer_id] = address
+        self._entries.move_to_end(customer_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
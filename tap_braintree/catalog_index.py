@@ -0,0 +1,40 @@
+"""Plans, add-ons and discounts of the merchant, loaded once per sync."""
+from typing import Iterable
+
+import braintree
+
+
+class CatalogIndex:
+    """The merchant's plans, add-ons and discounts by id.
+
+    Every subscription and many transactions repeat add-ons and discounts of
+    the catalog. RecordSerializer converts the ones whose id is in the index
+    once and reuses the result for identical copies in later records.
+    """
+
+    def __init__(
+        self,
+        plans: Iterable = (),
+        add_ons: Iterable = (),
+        discounts: Iterable = (),
+    ):
+        self.plans = list(plans)
+        self.plans_by_id = {plan.id: plan for plan in self.plans}
+        self.add_ons = {add_on.id: add_on for add_on in add_ons}
+        self.discounts = {discount.id: discount for discount in discounts}
+
+    @classmethod
+    def load(cls, gateway: braintree.BraintreeGateway) -> "CatalogIndex":
+        return cls(
+            plans=gateway.plan.all(),
+            add_ons=gateway.add_on.all(),
+            discounts=gateway.discount.all(),
+        )
+
+    def contains(self, item) -> bool:
+        """Whether item is an add-on or discount of the catalog."""
+        if isinstance(item, braintree.AddOn):
+            return getattr(item, "id", None) in self.add_ons
+        if isinstance(item, braintree.Discount):
+            return getattr(item, "id", None) in self.discounts
+        return False
@@ -1,45 +1,313 @@
 """Custom client handling, including BraintreeStream base class."""
-import braintree
-import pytz
+import copy
 import time
-from flatten_json import flatten
-from datetime import datetime, timedelta, date
+from datetime import date, datetime, time as datetime_time, timedelta, timezone
 from dateutil.relativedelta import relativedelta
 from dateutil.parser import isoparse
 
-import types
-from decimal import Decimal
-from braintree import Descriptor, RiskData
-from braintree.disbursement_detail import DisbursementDetail
-from braintree.transaction_details import TransactionDetails
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from threading import Event, Lock
 
-from typing import Any, Dict, Optional, Union, List, Iterable
+from typing import TYPE_CHECKING, Any, Generator, Optional, List, Iterable, Set
 
-from requests.exceptions import ReadTimeout
+from singer import RecordMessage
+from singer_sdk.helpers._catalog import pop_deselected_record_properties
+from singer_sdk.helpers._typing import (
+    _warn_unmapped_property,
+    conform_record_data_types,
+    is_boolean_type,
+)
+from singer_sdk.helpers._util import utc_now
 from singer_sdk.streams import Stream
 
+from tap_braintree.batch import BatchWriter
+from tap_braintree.fingerprints import RecordFingerprintIndex
+from tap_braintree.metrics import (
+    FETCH,
+    PARSE,
+    PERCENTILES,
+    SEARCH,
+    STAGES,
+    WindowMetrics,
+    peak_rss,
+    reset_peak_rss,
+    summarize,
+)
+
+if TYPE_CHECKING:
+    import braintree
+
+    from tap_braintree.pipeline import RecordPipeline
+    from tap_braintree.scheduler import RequestScheduler
+    from tap_braintree.serializer import RecordSerializer
+    from tap_braintree.tap import TapBraintree
+
+
+# Marks the end of a window's records in its buffer, see fetch_windows.
+_WINDOW_DONE = object()
+
+
+class WindowBuffer:
+    """Records of one window, handed from the worker fetching them to the
+    consumer through a queue of at most size records, see fetch_windows.
+
+    fill runs on the worker and waits while the queue is full, until stopped
+    is set. drain yields the records on the consumer, raising any error the
+    worker ran into.
+    """
+
+    def __init__(self, size: int, stopped: Event):
+        self.queue: queue.Queue = queue.Queue(size)
+        self.stopped = stopped
+
+    def fill(self, records: Iterable):
+        try:
+            for record in records:
+                if not self.put(record):
+                    return
+            result = _WINDOW_DONE
+        except Exception as e:
+            result = e
+        self.put(result)
+
+    def put(self, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def drain(self) -> Iterable:
+        while True:
+            item = self.queue.get()
+            if item is _WINDOW_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class ResultLimitExceededError(Exception):
+    """A window of min_window_hours still has more results than the API returns."""
+
+
+class BraintreeAttribute:
+    """Class attribute computed from the braintree package on first access.
+
+    Importing braintree takes a good share of the tap's startup, which --about
+    and --discover don't need. Streams define their searches with this, e.g.
+    BraintreeAttribute(lambda braintree: braintree.CustomerSearch.created_at),
+    so the package is only imported once a sync uses them.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        import braintree
+
+        value = self.function(braintree)
+        setattr(owner, self.name, value)
+        return value
+
+
+# Values conform_record_data_types converts, see BraintreeStream.conform_record.
+CONVERTED_TYPES = (date, timedelta, datetime_time, bytes)
+
+
+class ChangedRecordsSearch:
+    """The records of a stream with any incremental search field in a window.
+
+    One id search runs per field. The ids are de-duplicated across fields and
+    against the ids already synced by earlier windows, and the records are
+    fetched with a single ids search when the collection is iterated.
+    """
+
+    def __init__(self, stream, start, end):
+        self.stream = stream
+        self.ids = {}
+        self.maximum_size = 0
+        for field in stream.incremental_search_fields:
+            results = stream.braintree_obj.search(field.between(start, end))
+            self.maximum_size = max(self.maximum_size, results.maximum_size)
+            self.ids.update(dict.fromkeys(results.ids))
+
+    def __iter__(self):
+        """Yield the records not synced yet. If fetching fails, the ids that
+        weren't yielded are released, so a retry of the window fetches them."""
+        with self.stream.synced_ids_lock:
+            ids = [id for id in self.ids if id not in self.stream.synced_ids]
+            self.stream.synced_ids.update(ids)
+        if not ids:
+            return
+        unyielded = set(ids)
+        try:
+            for record in self.stream.braintree_obj.search(
+                self.stream.braintree_id_search.in_list(ids)
+            ):
+                unyielded.discard(record.id)
+                yield record
+        except Exception:
+            with self.stream.synced_ids_lock:
+                self.stream.synced_ids.difference_update(unyielded)
+            raise
+
 
 class BraintreeStream(Stream):
     """Stream class for braintree2 streams."""
 
+    _tap: "TapBraintree"
+
+    # Braintree search results are truncated at this many ids.
+    api_result_limit = 10000
+    # BraintreeGateway attribute the stream's records come from, e.g.
+    # "transaction" for gateway.transaction. set_braintree_config sets
+    # braintree_obj to it.
+    gateway_resource: Optional[str] = None
+    braintree_obj: Any = None
+    # Length of the next search window, updated as windows are fetched.
+    window_hours: Optional[float] = None
+    _serializer: Optional["RecordSerializer"] = None
+    _selected_properties: Optional[frozenset] = None
+    _record_pipeline: Optional["RecordPipeline"] = None
+    _boolean_properties: Optional[set] = None
+    _batch_writer: Optional[BatchWriter] = None
+    # Record properties repeating add-ons and discounts of the merchant's
+    # catalog, whose conversion the serializer reuses when one is selected,
+    # see CatalogIndex.
+    catalog_properties: tuple = ()
+    # Stage timings of the window get_records is emitting records from.
+    window_metrics: Optional[WindowMetrics] = None
+    # Record properties parse_record needs even when they aren't selected.
+    required_properties: tuple = ()
+    # Search fields that change whenever a record is updated. Streams that set
+    # them sync incrementally on updated_at once they have a bookmark.
+    incremental_search_fields: tuple = ()
+    braintree_id_search: Any = None
+    incremental_sync = False
+    # State key holding the end of the last completed window of a running sync.
+    window_checkpoint_key = "last_window_end"
+    # When the last checkpoint was written, and whether windows synced since
+    # then are still waiting for theirs, see checkpoint_window.
+    last_checkpoint = 0.0
+    checkpoint_pending = False
+    # Whether the stream's created_at range can be split into partitions, see
+    # partitions, and the partition state key recording how far one is synced.
+    partitionable = False
+    partition_synced_key = "synced_until"
+
     @property
     def braintree_objects(self):
+        from braintree import Descriptor, RiskData
+        from braintree.disbursement_detail import DisbursementDetail
+        from braintree.transaction_details import TransactionDetails
+
         return Descriptor, DisbursementDetail, RiskData, TransactionDetails
 
     @property
     def fetch_records_interval_hours(self):
         return self.config.get("fetch_records_interval_hours", 24)
 
+    @property
+    def max_parallel_windows(self):
+        return max(1, self.config.get("max_parallel_windows", 1))
+
+    @property
+    def id_first_fetch(self):
+        return self.config.get("id_first_fetch", False)
+
+    @property
+    def prefetch_pages(self):
+        return max(1, self.config.get("prefetch_pages", 2))
+
+    @property
+    def partition_months(self) -> Optional[int]:
+        return self.config.get("partition_months")
+
+    @property
+    def resync_recent_partition_days(self):
+        return self.config.get("resync_recent_partition_days", 31)
+
+    @property
+    def checkpoint_interval_seconds(self):
+        return self.config.get("checkpoint_interval_seconds", 60)
+
+    @property
+    def record_fingerprint_dir(self) -> Optional[str]:
+        return self.config.get("record_fingerprint_dir")
+
+    @property
+    def batch_writer(self) -> Optional[BatchWriter]:
+        """Writer of the stream's records to files, when batch_output_dir is set."""
+        if self._batch_writer is None and self.config.get("batch_output_dir"):
+            self._batch_writer = BatchWriter(
+                self.config["batch_output_dir"],
+                max_records=self.config.get("batch_max_records"),
+                exact_decimals=self.exact_decimals,
+            )
+        return self._batch_writer
+
+    @property
+    def exact_decimals(self) -> bool:
+        return self.config.get("exact_decimals", False)
+
+    @property
+    def measures_peak_memory(self) -> bool:
+        """Whether the peak memory of each window is measured, see WindowMetrics."""
+        return not self._tap.parallel_streams and self.max_parallel_windows == 1
+
+    @property
+    def max_buffered_records(self) -> Optional[int]:
+        value = self.config.get("max_buffered_records")
+        if value is None and self.max_parallel_windows > 1:
+            # Windows fetched ahead are never buffered whole.
+            value = 1000
+        return None if value is None else max(1, value)
+
+    @property
+    def pipeline_workers(self):
+        return self.config.get("pipeline_workers", 0)
+
+    @property
+    def pipeline_batch_size(self):
+        return self.config.get("pipeline_batch_size", 200)
+
+    @property
+    def pipeline_queue_size(self):
+        return max(1, self.config.get("pipeline_queue_size", 4))
+
+    @property
+    def adaptive_windows(self):
+        return self.config.get("adaptive_windows", False)
+
+    @property
+    def min_window_hours(self):
+        return self.config.get("min_window_hours", 1)
+
+    @property
+    def max_window_hours(self):
+        return self.config.get("max_window_hours", 24 * 31)
+
     @property
     def start_date(self):
-        # All of this logic is a workaround to how slow the Braintree API can be. We only
-        # need the last month of transactions because within that time period, their status
-        # would update and shouldn't update again after that. For subscriptions, things
-        # get a bit more complicated. On a daily basis, we only really need to fetch the
-        # last few days of data, because that would capture daily trials started But, since
-        # we care about the state of TTP and TTA subscriptions there's additional logic
-        # allowing for a weekly sync (grabs the last 3 months) and full sync of subscriptions
-        # data
+        # All of this logic is a workaround to how slow the Braintree API can be.
+        # We only need the last month of transactions because within that time
+        # period, their status would update and shouldn't update again after that.
+        # For subscriptions, things get a bit more complicated. On a daily basis,
+        # we only really need to fetch the last few days of data, because that
+        # would capture daily trials started But, since we care about the state of
+        # TTP and TTA subscriptions there's additional logic allowing for a weekly
+        # sync (grabs the last 3 months) and full sync of subscriptions data
         if self.config["sync_state"] == "regular":
             if self.name == "subscriptions":
                 return str(datetime.now() - relativedelta(months=1))
@@ -56,14 +324,6 @@ class BraintreeStream(Stream):
     def global_stream_state(self):
         return self.config.get("global_stream_state", "start_date")
 
-    @property
-    def braintree_config_merchant_id(self) -> dict:
-        return {
-            "merchant_id": self.config["merchant_id"],
-            "public_key": self.config["public_key"],
-            "private_key": self.config["private_key"],
-        }
-
     @staticmethod
     def date_range(start_date, end_date, interval_in_hours=24):
         """
@@ -92,89 +352,228 @@ class BraintreeStream(Stream):
             yield interval_start, interval_end
             current_date = interval_end
 
-    def check_api_result_limits(self, results):
-        try:
-            if self.name == "transactions":
-                assert results.maximum_size < 50000
-            else:
-                assert results.maximum_size < 10000
-        except AssertionError as e:
-            self.logger.error(
-                " ERROR: {} stream exceeded maximum records from API".format(
-                    self.name, results.maximum_size
+    def window_range(self, start_date, end_date):
+        """
+        Generator function like date_range, except that the window length is
+        read from self.window_hours before every window, so that fetch_window
+        can resize upcoming windows while the sync is running.
+
+        Args:
+            start_date (datetime): start of period
+            end_date (datetime): end of period
+
+        Yields:
+            tuple: window start and end datetimes
+
+        """
+        self.window_hours = self.fetch_records_interval_hours
+        current_date = start_date
+        while current_date < end_date:
+            interval_end = current_date + timedelta(hours=self.window_hours)
+
+            if interval_end > end_date:
+                interval_end = end_date
+
+            yield current_date, interval_end
+            current_date = interval_end
+
+    def exceeds_api_result_limits(self, results):
+        return results.maximum_size >= self.api_result_limit
+
+    def check_api_result_limits(self, results, start, end):
+        """Fail rather than sync a window the API truncated."""
+        if self.exceeds_api_result_limits(results):
+            raise ResultLimitExceededError(
+                "{}: {} records from {} - {} exceed the API limit of {}, lower "
+                "min_window_hours to split the window further".format(
+                    self.name, results.maximum_size, start, end, self.api_result_limit
                 )
             )
 
-    def set_braintree_config(self):
-        config = self.braintree_config_merchant_id
-        environment = getattr(braintree.Environment, "Production")
-        return braintree.Configuration.configure(environment, **config)
+    def can_split_window(self, start, end):
+        return (end - start) / 2 >= timedelta(hours=self.min_window_hours)
 
-    def object_to_dict(self, d, ignore_obj, level=0) -> dict:
-        level += 1
-        flat_attr = dict()
-        array_attr = dict()
+    def resize_window(self, start, end, result_size):
+        """Grow or shrink upcoming windows based on the size of the last one.
 
-        try:
-            attributes = d._setattrs
-        except AttributeError as e:
-            return d
-
-        for attr in attributes:
-            if attr == "addresses" and hasattr(d, attr):
-                # Get the first address with a non-None country_code_alpha2
-                addresses = getattr(d, attr)
-                if addresses and len(addresses) > 0:
-                    valid_address = next(
-                        (addr for addr in addresses if hasattr(addr, "country_code_alpha2") 
-                         and getattr(addr, "country_code_alpha2") is not None),
-                        addresses[0]  # Fallback to first address if none found
-                    )
-                    # Prefix address fields to avoid conflicts
-                    for address_attr in valid_address._setattrs:
-                        if hasattr(valid_address, address_attr):
-                            flat_attr[f"address_{address_attr}"] = getattr(valid_address, address_attr)
-                continue
-            if hasattr(d, attr) and isinstance(
-                getattr(d, attr), (list, set, tuple, types.GeneratorType)
-            ):
-                child_obj_list = []
-                for obj in getattr(d, attr):
-                    if isinstance(obj, dict):
-                        child_obj_list.append(
-                            flatten(self.object_to_dict(obj, ignore_obj, level=level))
-                        )
-                    else:
-                        child_obj_list.append(
-                            self.object_to_dict(obj, ignore_obj, level=level)
-                        )
-                if len(child_obj_list) > 0:
-                    array_attr[attr] = child_obj_list
-
-            elif hasattr(d, attr) and isinstance(getattr(d, attr), Decimal):
-                flat_attr[attr] = float(getattr(d, attr))
-            elif hasattr(d, attr) and isinstance(getattr(d, attr), datetime):
-                flat_attr[attr] = str(getattr(d, attr).replace(tzinfo=pytz.UTC))
-            elif hasattr(d, attr) and isinstance(getattr(d, attr), date):
-                value = getattr(d, attr)
-                flat_attr[attr] = str(
-                    datetime(value.year, value.month, value.day, tzinfo=pytz.UTC)
+        Windows less than a quarter full double in length and windows more than
+        half full are halved, within min_window_hours and max_window_hours.
+        """
+        if not self.adaptive_windows:
+            return
+
+        hours = (end - start).total_seconds() / 3600
+        if result_size < self.api_result_limit / 4:
+            hours = hours * 2
+        elif result_size > self.api_result_limit / 2:
+            hours = hours / 2
+        hours = min(max(hours, self.min_window_hours), self.max_window_hours)
+
+        if hours != self.window_hours:
+            self.logger.info(
+                " {}: {} records from {} - {}, window size {} -> {} hours".format(
+                    self.name, result_size, start, end, self.window_hours, hours
                 )
-            elif hasattr(d, attr) and isinstance(
-                getattr(d, attr), self.braintree_objects
-            ):
-                flat_attr[attr] = self.object_to_dict(
-                    getattr(d, attr), ignore_obj, level=level
+            )
+            self.window_hours = hours
+        self.write_window_metric("window_hours", hours, start, end)
+
+    def write_window_metric(self, metric, value, start, end):
+        self._write_metric_log(
+            {
+                "type": "gauge",
+                "metric": metric,
+                "value": value,
+                "tags": {
+                    "stream": self.name,
+                    "window_start": str(start),
+                    "window_end": str(end),
+                },
+            },
+            extra_tags=None,
+        )
+
+    def timed(self, stage: str):
+        """Time a block into the given stage of the current window."""
+        return (self.window_metrics or WindowMetrics(None, None)).timed(stage)
+
+    def write_window_timings(self, metrics: WindowMetrics):
+        """Emit the seconds spent in each stage of a window and its records."""
+        tags = {
+            "stream": self.name,
+            "window_start": str(metrics.start),
+            "window_end": str(metrics.end),
+        }
+        for stage in STAGES:
+            self._write_metric_log(
+                {
+                    "type": "timer",
+                    "metric": "window_stage_duration",
+                    "value": round(metrics.seconds[stage], 6),
+                    "tags": {**tags, "stage": stage},
+                },
+                extra_tags=None,
+            )
+        self._write_metric_log(
+            {
+                "type": "counter",
+                "metric": "window_record_count",
+                "value": metrics.records,
+                "tags": tags,
+            },
+            extra_tags=None,
+        )
+        if metrics.peak_memory is not None:
+            self._write_metric_log(
+                {
+                    "type": "gauge",
+                    "metric": "window_peak_memory_bytes",
+                    "value": metrics.peak_memory,
+                    "tags": tags,
+                },
+                extra_tags=None,
+            )
+
+    def write_timings_summary(self, window_metrics: List[WindowMetrics]):
+        """Emit and log the p50, p95 and p99 seconds per window of every stage."""
+        if not window_metrics:
+            return
+
+        summary = summarize(window_metrics)
+        for stage, percentiles in summary.items():
+            for q, seconds in percentiles.items():
+                self._write_metric_log(
+                    {
+                        "type": "timer",
+                        "metric": "window_stage_duration_percentile",
+                        "value": round(seconds, 6),
+                        "tags": {
+                            "stream": self.name,
+                            "stage": stage,
+                            "percentile": f"p{q}",
+                            "windows": len(window_metrics),
+                        },
+                    },
+                    extra_tags=None,
                 )
-            elif hasattr(d, attr):
-                flat_attr[attr] = getattr(d, attr)
-            else:
-                return
+        self.logger.info(
+            " {}: {} records in {} windows, p50/p95/p99 seconds per window: {}".format(
+                self.name,
+                sum(metrics.records for metrics in window_metrics),
+                len(window_metrics),
+                ", ".join(
+                    "{} {}".format(
+                        stage,
+                        "/".join(f"{summary[stage][q]:.3f}" for q in PERCENTILES),
+                    )
+                    for stage in STAGES
+                ),
+            )
+        )
 
-        flat_attr = flatten(flat_attr, root_keys_to_ignore=ignore_obj)
-        flat_attr.update(array_attr)
+        peaks = [(m.peak_memory, m) for m in window_metrics if m.peak_memory]
+        if peaks:
+            peak, largest = max(peaks, key=lambda item: item[0])
+            self.logger.info(
+                " {}: peak process memory {:.1f} MiB, in window {} - {}".format(
+                    self.name, peak / 2**20, largest.start, largest.end
+                )
+            )
+
+    def finish_sync(self):
+        """Release what the stream keeps across partitions. Called by the tap
+        once the stream is synced, on the thread that synced it."""
+
+    @property
+    def request_scheduler(self) -> "RequestScheduler":
+        return self._tap.request_scheduler
+
+    @property
+    def max_window_retries(self):
+        return self.config.get("max_window_retries", 3)
+
+    @property
+    def gateway(self) -> "braintree.BraintreeGateway":
+        return self._tap.gateway
+
+    def set_braintree_config(self):
+        """Make the stream's requests with the tap's shared gateway and point
+        the serializer at the catalog if selected properties reference it.
+
+        Loading the catalog takes three requests, which streams that don't
+        emit any of their catalog_properties skip.
+        """
+        self.braintree_obj = getattr(self.gateway, self.gateway_resource)
+        if self.selected_properties.intersection(self.catalog_properties):
+            self.serializer.catalog = self._tap.catalog_index
+
+    @property
+    def serializer(self) -> "RecordSerializer":
+        if self._serializer is None:
+            from tap_braintree.serializer import RecordSerializer
+
+            self._serializer = RecordSerializer(
+                self.braintree_objects, exact_decimals=self.exact_decimals
+            )
+        return self._serializer
+
+    @property
+    def selected_properties(self) -> frozenset:
+        """Top level schema properties selected in the catalog, plus the ones
+        parse_record and the bookmark read. Attributes that can't produce any of
+        them are skipped when records are converted."""
+        if self._selected_properties is None:
+            self._selected_properties = frozenset(
+                name
+                for name in self.schema["properties"]
+                if self.mask[("properties", name)]
+            ) | frozenset(self.required_properties)
+            if self.replication_key:
+                self._selected_properties |= {self.replication_key}
+        return self._selected_properties
 
-        return flat_attr
+    def object_to_dict(self, d, ignore_obj, level=0, projection=None) -> dict:
+        return self.serializer.to_dict(d, ignore_obj, projection=projection)
 
     def contains_latest_record(self, record, last_updated):
         if getattr(record, "updated_at") > last_updated:
@@ -208,99 +607,657 @@ class BraintreeStream(Stream):
                 return True
         return False
 
-    def parse_record(self, record) -> dict:
-        json_obj = {
-            "disputes",
-            "status_history",
-            "discounts",
-            "risk_data_decision_reasons",
-            "refund_ids",
-            "refund_global_ids",
-        }
+    @classmethod
+    def convert_record(cls, serializer, record, projection=None) -> dict:
+        """Convert a raw Braintree object to a record dict.
+
+        This is the CPU bound part of parse_record. It doesn't use the stream
+        instance, so the pipelined mode can run it in its conversion processes.
+        """
         ignore_obj = {"transactions"}
+        return serializer.to_dict(record, ignore_obj, projection=projection)
+
+    def parse_record(self, record) -> dict:
+        return self.convert_record(self.serializer, record, self.selected_properties)
+
+    def convert_records(self, records: Iterable) -> Iterable[dict]:
+        """Convert a stream of raw Braintree objects, preserving their order.
+
+        With pipeline_workers set, records are fetched on a separate thread and
+        converted on a process pool, see RecordPipeline.
+        """
+        metrics = self.window_metrics or WindowMetrics(None, None)
+        if self.pipeline_workers:
+            yield from metrics.timed_iter(PARSE, self.record_pipeline.convert(records))
+            return
+        for record in records:
+            with metrics.timed(PARSE):
+                parsed = self.convert_record(
+                    self.serializer, record, self.selected_properties
+                )
+            yield parsed
+
+    def parse_records(self, records: Iterable) -> Iterable[dict]:
+        """Parse a stream of raw Braintree objects, preserving their order.
+
+        Streams override this to run a stage over several records at once.
+        """
+        yield from self.convert_records(records)
+
+    @property
+    def record_pipeline(self) -> "RecordPipeline":
+        if self._record_pipeline is None:
+            from tap_braintree.pipeline import RecordPipeline
+
+            self._record_pipeline = RecordPipeline(
+                self._tap.process_pool,
+                type(self),
+                self.braintree_objects,
+                self.selected_properties,
+                batch_size=self.pipeline_batch_size,
+                queue_size=self.pipeline_queue_size,
+                exact_decimals=self.exact_decimals,
+            )
+        return self._record_pipeline
+
+    @property
+    def partitions(self) -> Optional[List[dict]]:
+        """Ranges of created_at of partition_months months each, covering
+        start_date up to now, as partition_start and partition_end contexts.
+
+        The ranges are aligned on multiples of partition_months months since
+        year 0, so the contexts and with them their state stay the same from
+        run to run. Without partition_months, the partitions in state, if any.
+        """
+        if not (self.partitionable and self.partition_months):
+            return super().partitions
+
+        months = self.partition_months
+        start = isoparse(self.start_date)
+        index = (start.year * 12 + start.month - 1) // months * months
+        boundary = datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+        now = datetime.now(timezone.utc)
+        partitions = []
+        while boundary < now:
+            end = boundary + relativedelta(months=months)
+            partitions.append(
+                {
+                    "partition_start": boundary.isoformat(),
+                    "partition_end": end.isoformat(),
+                }
+            )
+            boundary = end
+        return partitions
+
+    @staticmethod
+    def get_partition_range(context: Optional[dict]) -> Optional[tuple]:
+        """Return the (start, end) created_at range of a partition context."""
+        if not context or "partition_start" not in context:
+            return None
+        return isoparse(context["partition_start"]), isoparse(context["partition_end"])
+
+    def is_partition_synced(self, state: dict, partition_end: datetime) -> bool:
+        """Whether an earlier run synced the whole partition and the partition
+        is too old for its records to change."""
+        synced_until = state.get(self.partition_synced_key)
+        if not synced_until or isoparse(synced_until) < partition_end:
+            return False
+        recent = datetime.now(timezone.utc) - timedelta(
+            days=self.resync_recent_partition_days
+        )
+        return partition_end <= recent
 
-        data = self.object_to_dict(record, ignore_obj)
-        return data
+    def get_updated_at_bookmark(self, context: Optional[dict]) -> Optional[datetime]:
+        """Return the updated_at bookmark of an incremental stream, if any.
+
+        Partitions always sync their whole created_at range.
+        """
+        if not self.incremental_search_fields or self.get_partition_range(context):
+            return None
+
+        state = self.get_context_state(context)
+        value = state.get("replication_key_value")
+        if not value or state.get("replication_key") != self.replication_key:
+            return None
+        return isoparse(value)
+
+    def open_fingerprint_index(self) -> Optional[RecordFingerprintIndex]:
+        """Open the stream's fingerprint index, if record_fingerprint_dir is set."""
+        if not self.record_fingerprint_dir:
+            return None
+        return RecordFingerprintIndex(
+            Path(self.record_fingerprint_dir) / f"{self.name}.sqlite",
+            ttl_days=self.config.get("fingerprint_ttl_days", 90),
+            force=self.config.get("force_full_emit", False),
+        )
+
+    def record_key(self, record: dict) -> str:
+        return "|".join(str(record.get(key)) for key in self.primary_keys or ())
+
+    def write_unchanged_records(self, fingerprints: RecordFingerprintIndex):
+        self.logger.info(
+            f" {self.name}: Skipped {fingerprints.unchanged} unchanged records"
+        )
+        self._write_metric_log(
+            {
+                "type": "counter",
+                "metric": "unchanged_record_count",
+                "value": fingerprints.unchanged,
+                "tags": {"stream": self.name},
+            },
+            extra_tags=None,
+        )
+
+    def get_resume_timestamp(self, state: dict, start_timestamp: datetime) -> datetime:
+        """Return where the sync should start, skipping the windows an interrupted
+        run already completed."""
+        checkpoint = state.get(self.window_checkpoint_key)
+        if not checkpoint:
+            return start_timestamp
+
+        checkpoint = isoparse(checkpoint)
+        if checkpoint <= start_timestamp:
+            return start_timestamp
+        self.logger.info(
+            f" {self.name}: Resuming from the last completed window at {checkpoint}"
+        )
+        return checkpoint
+
+    def _write_schema_message(self):
+        with self._tap.message_lock:
+            self._tap.flush_messages()
+            super()._write_schema_message()
+
+    def _write_record_message(self, record: dict):
+        """Write a RECORD message, through the tap's buffered message writer
+        when fast_output is enabled, or the record to the stream's batch files
+        when batch_output_dir is set."""
+        writer = self._tap.message_writer
+        batches = self.batch_writer
+        if writer is None and batches is None:
+            with self._tap.message_lock:
+                super()._write_record_message(record)
+            return
+
+        # Same as Stream._write_record_message, but for the writer.
+        pop_deselected_record_properties(record, self.schema, self.mask, self.logger)
+        record = self.conform_record(record)
+        for stream_map in self.stream_maps:
+            mapped_record = stream_map.transform(record)
+            if mapped_record is None:
+                continue
+            if batches:
+                batches.write(stream_map.stream_alias, mapped_record)
+                continue
+            assert writer is not None
+            message = RecordMessage(
+                stream=stream_map.stream_alias,
+                record=mapped_record,
+                version=None,
+                time_extracted=utc_now(),
+            )
+            with self._tap.message_lock:
+                writer.write(message)
+
+    def write_batch_messages(self):
+        """Write a BATCH message for the files of records written since the
+        last one."""
+        if self._batch_writer is None:
+            return
+        messages = self._batch_writer.take_messages()
+        if messages:
+            with self._tap.message_lock:
+                self._tap.write_raw_messages(messages)
+
+    @property
+    def boolean_properties(self) -> set:
+        if self._boolean_properties is None:
+            self._boolean_properties = {
+                name
+                for name, schema in self.schema["properties"].items()
+                if is_boolean_type(schema)
+            }
+        return self._boolean_properties
+
+    def conform_record(self, record: dict) -> dict:
+        """Same as conform_record_data_types, which checks the schema of every
+        value, for records of mostly strings and numbers.
+
+        Values that need converting are left to conform_record_data_types.
+        """
+        properties = self.schema["properties"]
+        booleans = self.boolean_properties
+        conformed = {}
+        for name, value in record.items():
+            if name not in properties:
+                _warn_unmapped_property(self.name, name, self.logger)
+            elif isinstance(value, CONVERTED_TYPES):
+                conformed.update(
+                    conform_record_data_types(
+                        self.name, {name: value}, self.schema, self.logger
+                    )
+                )
+            elif name in booleans:
+                conformed[name] = None if value is None else value != 0
+            else:
+                conformed[name] = value
+        return conformed
+
+    def _write_state_message(self):
+        """Write a STATE message. When streams sync in parallel, the tap builds
+        it from a copy of this stream's state, see TapBraintree.write_stream_state.
+
+        The records a STATE message covers must be written first, so it's
+        preceded by the BATCH message of any records in batch files.
+        """
+        self.write_batch_messages()
+        if self._tap.parallel_streams:
+            self._tap.write_stream_state(self.name, copy.deepcopy(self.stream_state))
+        else:
+            with self._tap.message_lock:
+                self._tap.flush_messages()
+            super()._write_state_message()
+
+    def checkpoint_window(self, state: dict, end: datetime, records: int):
+        """Record that every window up to end is synced and emit a STATE message.
+
+        Windows without records are only checkpointed once every
+        checkpoint_interval_seconds, an interrupted run refetches the others.
+        """
+        state[self.window_checkpoint_key] = end.isoformat()
+        elapsed = time.monotonic() - self.last_checkpoint
+        if records or elapsed >= self.checkpoint_interval_seconds:
+            self.write_checkpoint()
+        else:
+            self.checkpoint_pending = True
+
+    def write_checkpoint(self):
+        """Emit a STATE message with the stream's latest checkpoint."""
+        self._write_state_message()
+        self.last_checkpoint = time.monotonic()
+        self.checkpoint_pending = False
+
+    def get_sync_range(self, context: Optional[dict], partition) -> tuple:
+        """Return the UTC start and end of the range the sync covers, the
+        partition's range if there is one."""
+        if partition:
+            start_timestamp = isoparse(self.start_date)
+        else:
+            start_timestamp = self.get_starting_timestamp(context) or isoparse(
+                self.start_date
+            )
+        start_timestamp = start_timestamp.replace(tzinfo=timezone.utc)
+        end_timestamp = datetime.utcnow().replace(tzinfo=timezone.utc)
+        if partition:
+            start_timestamp = max(start_timestamp, partition[0])
+            end_timestamp = min(end_timestamp, partition[1])
+        return start_timestamp, end_timestamp
+
+    def start_incremental_search(self, context: Optional[dict]) -> datetime:
+        """Choose between searching changed records and searching by creation
+        date, and return the time records must be updated after to be emitted.
+
+        Braintree won't let you search on updated_at. Once a stream has an
+        updated_at bookmark, incremental runs search the stream's status change
+        fields from the bookmark instead, see ChangedRecordsSearch. Runs without
+        a bookmark fall back to global_stream_state.
+        """
+        bookmark = self.get_updated_at_bookmark(context)
+        self.incremental_sync = bookmark is not None
+        self.synced_ids: Set[str] = set()
+        self.synced_ids_lock = Lock()
+        if bookmark is not None:
+            return bookmark.astimezone(timezone.utc).replace(tzinfo=None)
+        return datetime.strptime(self.global_stream_state, "%Y-%m-%d")
+
+    def sync_windows(self, windows, state_dict: dict, last_updated) -> Iterable[dict]:
+        """Yield the records of every window, checkpointing each one."""
+        window_metrics = []
+        # Records identical to the ones emitted by earlier runs are skipped.
+        fingerprints = self.open_fingerprint_index()
+        completed = False
+        self.last_checkpoint = time.monotonic()
+        self.checkpoint_pending = False
+        self.start_window_measures()
+        try:
+            for start, end, records, metrics in self.fetch_windows(windows):
+                self.window_metrics = metrics
+                window_metrics.append(metrics)
+                metrics.records = yield from self.emit_window(
+                    records, last_updated, fingerprints
+                )
+                self.finish_window(state_dict, start, end, metrics, fingerprints)
+                self.start_window_measures()
+            completed = True
+        except BaseException:
+            # The windows before the failing one stay synced.
+            if self.checkpoint_pending:
+                self.write_checkpoint()
+            # Files of records that were never announced are of no use.
+            if self._batch_writer:
+                self._batch_writer.discard()
+            raise
+        finally:
+            if self._tap.profiler:
+                self._tap.profiler.window_finished(self.name)
+            if fingerprints:
+                self.write_unchanged_records(fingerprints)
+                fingerprints.close(commit=completed)
+            self.window_metrics = None
+            self.write_timings_summary(window_metrics)
+
+    def start_window_measures(self):
+        """Start the profiler's clock and the peak memory of the next window.
+
+        The profiler only samples windows that take longer than
+        profile_min_window_seconds, including the wait for their records.
+        """
+        if self._tap.profiler:
+            self._tap.profiler.window_started(self.name)
+        if self.measures_peak_memory:
+            reset_peak_rss()
+
+    def emit_window(
+        self, records, last_updated, fingerprints
+    ) -> Generator[dict, None, int]:
+        """Yield the parsed records of a window updated after last_updated and
+        changed since they were last emitted, and return how many were parsed."""
+        processed_count = 0
+        for parsed in self.parse_records(
+            record
+            for record in records
+            if self.contains_latest_record(record, last_updated)
+        ):
+            processed_count += 1
+            if fingerprints and not fingerprints.changed(
+                self.record_key(parsed), parsed
+            ):
+                continue
+            yield parsed
+        return processed_count
+
+    def finish_window(self, state_dict: dict, start, end, metrics, fingerprints):
+        """Report a window whose records were all emitted and checkpoint it."""
+        if self.measures_peak_memory:
+            metrics.peak_memory = peak_rss()
+        self.write_window_timings(metrics)
+
+        self.logger.info(
+            " {}: Processed {} records from {} - {} at {}".format(
+                self.name,
+                metrics.records,
+                start,
+                end,
+                datetime.utcnow(),
+            )
+        )
+        self.checkpoint_window(state_dict, end, metrics.records)
+        if fingerprints:
+            fingerprints.commit()
+
+    def search_window(self, start, end):
+        """Run the search for one window and return its results collection."""
+        if self.incremental_sync:
+            return ChangedRecordsSearch(self, start, end)
+        return self.braintree_obj.search(self.braintree_search.between(start, end))
+
+    def fetch_window(
+        self, start, end, metrics: Optional[WindowMetrics] = None
+    ) -> Iterable:
+        """Yield the raw Braintree objects created between start and end.
+
+        Maintenance windows are waited out and the search is retried. Connection
+        errors, timeouts, throttling and server errors that outlast the retries
+        of the request scheduler retry the window, up to max_window_retries
+        times with backoff, before the sync fails. A window whose results hit
+        the API limit is bisected and both halves are fetched instead, and one
+        that can't be split below min_window_hours fails the sync. The search
+        and the page fetches are timed into metrics.
+        """
+        import braintree
+
+        from tap_braintree.scheduler import RETRYABLE_ERRORS
+
+        metrics = metrics or WindowMetrics(start, end)
+        attempt = 0
+        yielded: Set[str] = set()
+        while True:
+            try:
+                with metrics.timed(SEARCH):
+                    records = self.search_window(start, end)
+                if self.exceeds_api_result_limits(records) and self.can_split_window(
+                    start, end
+                ):
+                    middle = self.split_window(start, end, records)
+                    yield from self.fetch_window(start, middle, metrics)
+                    yield from self.fetch_window(middle, end, metrics)
+                    return
+
+                yield from self.fetch_window_records(
+                    start, end, records, metrics, yielded
+                )
+
+            except (
+                braintree.exceptions.down_for_maintenance_error.DownForMaintenanceError
+            ) as e:
+                self.logger.error(f" Exception: {str(e)}")
+                self.logger.error("Waiting 1 hour, then trying again...")
+                time.sleep(3600)
+                continue
+
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                self.wait_to_retry_window(start, end, attempt, e)
+                continue
+
+            break
+
+    def split_window(self, start, end, records) -> datetime:
+        """Return the middle of a window over the API limit, shrinking upcoming
+        windows to its halves with adaptive_windows enabled."""
+        middle = start + (end - start) / 2
+        self.logger.warning(
+            " {}: {} records from {} - {} exceed the API limit, "
+            "splitting the window at {}".format(
+                self.name, records.maximum_size, start, end, middle
+            )
+        )
+        self.write_window_metric("window_split", records.maximum_size, start, end)
+        if self.adaptive_windows:
+            self.window_hours = max(
+                (middle - start).total_seconds() / 3600, self.min_window_hours
+            )
+        return middle
+
+    def fetch_window_records(self, start, end, records, metrics, yielded) -> Iterable:
+        """Yield the records of a window's search results that aren't in
+        yielded, adding them to it, so a retried window skips the records it
+        already yielded."""
+        self.check_api_result_limits(records, start, end)
+        self.resize_window(start, end, records.maximum_size)
+        self.logger.info(
+            " {}: Fetched {} records from {} - {}".format(
+                self.name, records.maximum_size, start, end
+            )
+        )
+        if self.id_first_fetch:
+            records = self.fetch_pages(records)
+        for record in metrics.timed_iter(FETCH, records):
+            if record.id not in yielded:
+                yielded.add(record.id)
+                yield record
+
+    def wait_to_retry_window(self, start, end, attempt, error):
+        """Back off before retrying a window for the attempt-th time, or raise
+        RetriesExhaustedError once max_window_retries are used up."""
+        from tap_braintree.scheduler import RetriesExhaustedError
+
+        if attempt > self.max_window_retries:
+            self.logger.error(
+                " {}: Failed to process records from {} - {}".format(
+                    self.name,
+                    start.date(),
+                    end.date(),
+                )
+            )
+            raise RetriesExhaustedError(
+                f"{self.name}: window {start} - {end} failed "
+                f"{attempt} times: {error}"
+            ) from error
+
+        self.logger.warning(
+            f" {self.name}: Retrying window {start} - {end} after: {error}"
+        )
+        self.request_scheduler.wait(attempt)
+
+    def fetch_page(self, records, ids) -> list:
+        """Fetch the records of one page of ids from a search result."""
+        # ResourceCollection keeps the search and page fetch private. Using them
+        # gets a page with one request instead of a new ids search first.
+        fetch = getattr(records, "_ResourceCollection__method", None)
+        if fetch is not None:
+            return fetch(getattr(records, "_ResourceCollection__query"), ids)
+        return list(self.braintree_obj.search(self.braintree_id_search.in_list(ids)))
+
+    def fetch_pages(self, records) -> Iterable:
+        """Yield the records of a search result, fetching pages ahead.
+
+        The id list of the result is taken up front and ids already emitted by
+        this sync are skipped. Up to prefetch_pages pages are requested on a
+        thread pool while the current one is consumed, fewer if the pages held
+        would exceed max_buffered_records. If fetching fails, the
+        ids that weren't yielded are released so a retry fetches them again.
+        """
+        with self.synced_ids_lock:
+            ids = [
+                id for id in dict.fromkeys(records.ids) if id not in self.synced_ids
+            ]
+            self.synced_ids.update(ids)
+        page_size = getattr(records, "_ResourceCollection__page_size", 50)
+        remaining = iter(ids)
+        pages = list(iter(lambda: list(islice(remaining, page_size)), []))
+        prefetch_pages = self.prefetch_pages
+        if self.max_buffered_records is not None:
+            # The page being consumed counts towards the bound too.
+            prefetch_pages = max(
+                1, min(prefetch_pages, self.max_buffered_records // page_size - 1)
+            )
+
+        pending: deque = deque()
+        with ThreadPoolExecutor(
+            max_workers=prefetch_pages,
+            thread_name_prefix=f"{self.name}-page",
+        ) as executor:
+            try:
+                for page in pages:
+                    pending.append(
+                        (page, executor.submit(self.fetch_page, records, page))
+                    )
+                    if len(pending) > prefetch_pages:
+                        page, future = pending.popleft()
+                        yield from self.release_each(future.result())
+
+                while pending:
+                    page, future = pending.popleft()
+                    yield from self.release_each(future.result())
+            except Exception:
+                with self.synced_ids_lock:
+                    self.synced_ids.difference_update(page)
+                    for page, _ in pending:
+                        self.synced_ids.difference_update(page)
+                raise
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def release_each(items: list) -> Iterable:
+        """Yield the items of a list, dropping each from it once yielded.
+
+        The list stays referenced while it is iterated, here by the future of a
+        page. Popping the items lets every record be freed as soon as the
+        consumer is done with it, instead of with the whole page.
+        """
+        items.reverse()
+        while items:
+            yield items.pop()
+
+    def fetch_windows(self, windows) -> Iterable[tuple]:
+        """Yield a (start, end, records, metrics) tuple for every window, in
+        window order, where metrics holds the stage timings of the window.
+
+        With max_parallel_windows > 1 the searches for upcoming windows run on a
+        thread pool while the current one is consumed. At most that many windows
+        are in flight or buffered at any time, and each worker runs the retry
+        loop of fetch_window for its own window only.
+
+        Each worker hands its records over through a queue of
+        max_buffered_records records, 1000 unless set, and waits while it is
+        full, so memory stays bounded however large the windows are. Windows
+        fetched one at a time are streamed as their pages arrive.
+        """
+        if self.max_parallel_windows == 1:
+            for start, end in windows:
+                metrics = WindowMetrics(start, end)
+                yield start, end, self.fetch_window(start, end, metrics), metrics
+            return
+
+        stopped = Event()
+        # (start, end, future, metrics, buffer) of the windows in flight.
+        pending: deque = deque()
+        with ThreadPoolExecutor(
+            max_workers=self.max_parallel_windows,
+            thread_name_prefix=f"{self.name}-window",
+        ) as executor:
+            try:
+                for start, end in windows:
+                    metrics = WindowMetrics(start, end)
+                    buffer = WindowBuffer(self.max_buffered_records or 0, stopped)
+                    records = self.fetch_window(start, end, metrics)
+                    future = executor.submit(buffer.fill, records)
+                    pending.append((start, end, future, metrics, buffer))
+                    if len(pending) >= self.max_parallel_windows:
+                        start, end, _, metrics, buffer = pending.popleft()
+                        yield start, end, buffer.drain(), metrics
+
+                while pending:
+                    start, end, _, metrics, buffer = pending.popleft()
+                    yield start, end, buffer.drain(), metrics
+            finally:
+                stopped.set()
+                for _, _, future, _, _ in pending:
+                    future.cancel()
 
     def get_records(self, context: Optional[dict]) -> Iterable[dict]:
         """Return a generator of row-type dictionary objects."""
         self.logger.info(f" tap_states: {self.tap_state}")
 
         self.set_braintree_config()
-        start_timestamp = self.get_starting_timestamp(context) or isoparse(
-            self.start_date
-        )
-        start_timestamp = start_timestamp.replace(tzinfo=pytz.timezone("UTC"))
-        end_timestamp = datetime.utcnow()
-        end_timestamp = end_timestamp.replace(tzinfo=pytz.timezone("UTC"))
+        state_dict = self.get_context_state(context)
+        partition = self.get_partition_range(context)
+        if partition and self.is_partition_synced(state_dict, partition[1]):
+            self.logger.info(
+                f" {self.name}: Skipping partition {partition[0]} - "
+                f"{partition[1]}, synced by an earlier run"
+            )
+            return
+        start_timestamp, end_timestamp = self.get_sync_range(context, partition)
         self.logger.info(
-            f"start timestamp is: {start_timestamp} and end timestamp is: {end_timestamp}"
+            f"start timestamp is: {start_timestamp} "
+            f"and end timestamp is: {end_timestamp}"
         )
-        state_dict = self.get_context_state(context)
 
         self.logger.info(f" state_dict: {state_dict}")
         self.logger.info(f" tap_states: {self.tap_state}")
 
-        """  
-        TODO: 
-            Come up with a better way to make this work as state isn't working because multi-key state is unsupported
-            from one stream and because braintree won't let you query by updated_at for all the needed keys
-        """
-        last_updated = datetime.strptime(self.global_stream_state, "%Y-%m-%d")
+        last_updated = self.start_incremental_search(context)
+        self.logger.info(f"last_updated: {last_updated}")
 
-        for start, end in self.date_range(
-            start_timestamp,
-            end_timestamp,
-            interval_in_hours=self.fetch_records_interval_hours,
-        ):
-            while True:
-                try:
-                    records = self.braintree_obj.search(
-                        self.braintree_search.between(start, end)
-                    )
-                    self.check_api_result_limits(records)
-                    max_records_expected = records.maximum_size
-                    self.logger.info(
-                        " {}: Fetched {} records from {} - {}".format(
-                            self.name, max_records_expected, start, end
-                        )
-                    )
+        start_timestamp = self.get_resume_timestamp(state_dict, start_timestamp)
+        windows = self.window_range(start_timestamp, end_timestamp)
+        yield from self.sync_windows(windows, state_dict, last_updated)
 
-                    processed_count = 0
-                    self.logger.info(f"last_updated: {last_updated}")
-                    for record in records:
-                        if self.contains_latest_record(record, last_updated):
-                            processed_count += 1
-                            yield self.parse_record(record)
-
-                except (
-                    braintree.exceptions.down_for_maintenance_error.DownForMaintenanceError
-                ) as e:
-                    self.logger.error(f" Exception: {str(e)}")
-                    self.logger.error("Waiting 1 hour, then trying again...")
-                    time.sleep(3600)
-                    continue
-
-                except (ConnectionError, ReadTimeout) as e:
-                    self.logger.error(
-                        " {}: Failed to process records from {} - {}".format(
-                            self.name,
-                            start.date(),
-                            end.date(),
-                        )
-                    )
-                    self.logger.error(f" Exception: {str(e)}")
-                    self.logger.error(
-                        f" Exception occurred while processing record:\n{record}"
-                    )
-                    break
-
-                self.logger.info(
-                    " {}: Processed {} of {} records at {}".format(
-                        self.name,
-                        processed_count,
-                        max_records_expected,
-                        datetime.utcnow(),
-                    )
-                )
-                break
+        # The sync finished, the next run starts from its bookmark again.
+        state_dict.pop(self.window_checkpoint_key, None)
+        if partition:
+            state_dict[self.partition_synced_key] = end_timestamp.isoformat()
@@ -0,0 +1,75 @@
+"""Index of record fingerprints used to skip records that did not change."""
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+
+def fingerprint(record: dict) -> bytes:
+    """Return a hash of the content of a parsed record."""
+    content = json.dumps(record, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.blake2b(content.encode(), digest_size=16).digest()
+
+
+class RecordFingerprintIndex:
+    """SQLite file of record key -> fingerprint of the record last emitted.
+
+    changed records the fingerprint of every record it is given and tells
+    whether the record differs from the one the index holds. The new
+    fingerprints only become visible to later runs on commit, which the
+    stream calls once the records are emitted and their window is
+    checkpointed, so records of an interrupted window are emitted again.
+
+    With force set every record counts as changed, which rebuilds the index
+    from the records emitted. close drops the entries of records not seen for
+    ttl_days and compacts the file when most of it is free space.
+    """
+
+    def __init__(self, path, ttl_days=90, force=False):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_days * 24 * 3600
+        self.force = force
+        self.unchanged = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "key TEXT PRIMARY KEY, fingerprint BLOB, seen_at REAL)"
+        )
+
+    def changed(self, key: str, record: dict) -> bool:
+        value = fingerprint(record)
+        row = self._db.execute(
+            "SELECT fingerprint FROM fingerprints WHERE key = ?", (key,)
+        ).fetchone()
+        self._db.execute(
+            "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)",
+            (key, value, time.time()),
+        )
+        if not self.force and row is not None and row[0] == value:
+            self.unchanged += 1
+            return False
+        return True
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self, commit=True):
+        """Close the index, discarding the fingerprints since the last commit
+        unless commit is set."""
+        if commit:
+            self._db.execute(
+                "DELETE FROM fingerprints WHERE seen_at < ?",
+                (time.time() - self.ttl_seconds,),
+            )
+            self._db.commit()
+            self.compact()
+        self._db.close()
+
+    def compact(self):
+        """Reclaim the space of deleted entries once it is most of the file."""
+        (pages,) = self._db.execute("PRAGMA page_count").fetchone()
+        (free,) = self._db.execute("PRAGMA freelist_count").fetchone()
+        if free * 2 > pages:
+            self._db.execute("VACUUM")
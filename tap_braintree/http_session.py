@@ -0,0 +1,51 @@
+"""Pooled HTTP session shared by the Braintree API requests of the tap."""
+import requests
+from braintree.environment import Environment
+from braintree.util.http import Http
+
+
+def create_session(pool_size: int = 10) -> requests.Session:
+    """Return a keep-alive session holding up to pool_size connections."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class PooledHttp(Http):
+    """Braintree HTTP strategy that reuses one session for every request.
+
+    The SDK opens a new session, and with it a new TLS connection, for each
+    request. This strategy sends the same requests over a shared session whose
+    connection pool is safe to use from several threads.
+    """
+
+    def __init__(self, config, environment=None, session=None):
+        super().__init__(config, environment)
+        self.session = session or create_session()
+
+    def http_do(self, http_verb, path, headers, request_body):
+        data = request_body
+        files = None
+        if type(request_body) is tuple:
+            data, files = request_body
+
+        full_path = path
+        if not path.startswith(self.config.base_url()):
+            full_path = self.config.base_url() + path
+
+        if self.config.environment == Environment.Development:
+            verify = False
+        else:
+            verify = self.environment.ssl_certificate
+
+        request = requests.Request(
+            method=http_verb, url=full_path, headers=headers, data=data, files=files
+        )
+        prepared_request = request.prepare()
+        prepared_request.url = full_path
+        response = self.session.send(
+            prepared_request, verify=verify, timeout=self.config.timeout
+        )
+        return [response.status_code, response.text]
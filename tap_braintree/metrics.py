@@ -0,0 +1,129 @@
+"""Per-window stage timings and peak memory of a stream sync."""
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+# Stages of a window, in the order they happen to a record.
+SEARCH = "search"
+FETCH = "fetch"
+PARSE = "parse"
+ENRICHMENT = "enrichment"
+STAGES = (SEARCH, FETCH, PARSE, ENRICHMENT)
+
+PERCENTILES = (50, 95, 99)
+
+PEAK_RSS = re.compile(r"^VmHWM:\s+(\d+) kB", re.MULTILINE)
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident memory of the process, where Linux allows it.
+
+    The peak is one number for the whole process, so a reset discards the
+    peaks of every other thread measuring it.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss() -> Optional[int]:
+    """Return the peak resident memory of the process in bytes.
+
+    On Linux this is the peak since the last reset_peak_rss, elsewhere the
+    peak since the process started.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            match = PEAK_RSS.search(f.read())
+        if match:
+            return int(match.group(1)) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Return the q-th percentile of values, interpolating between ranks."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = (len(values) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class WindowMetrics:
+    """Seconds spent in each stage of one window, and the records it emitted.
+
+    search is the API search for the window and fetch the time spent waiting
+    for its pages of records. parse is the conversion of the records to dicts
+    and enrichment the lookups that complete them, such as the customer
+    addresses of transactions. With the pipelined mode enabled, parse is the
+    time spent waiting for converted records. Stages of a window may be timed
+    from several threads.
+
+    peak_memory is the peak resident memory of the whole process while the
+    window was emitted, see peak_rss. Resetting that peak is process-wide, so
+    it is only measured when streams and windows are synced one at a time,
+    and stays None otherwise.
+    """
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.records = 0
+        self.peak_memory: Optional[int] = None
+        self.seconds: Dict[str, float] = dict.fromkeys(STAGES, 0.0)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.seconds[stage] += seconds
+
+    @contextmanager
+    def timed(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def timed_iter(self, stage: str, iterable: Iterable) -> Iterable:
+        """Yield the items of iterable, timing only the wait for each item."""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - started)
+                return
+            self.add(stage, time.perf_counter() - started)
+            yield item
+
+
+def summarize(windows: List[WindowMetrics]) -> Dict[str, Dict[int, float]]:
+    """Return the percentiles of the seconds per window of every stage."""
+    return {
+        stage: {
+            q: percentile([window.seconds[stage] for window in windows], q)
+            for q in PERCENTILES
+        }
+        for stage in STAGES
+    }
@@ -0,0 +1,62 @@
+"""Buffered writer of Singer messages for the fast output path."""
+import sys
+
+import simplejson
+
+try:
+    import orjson
+except ImportError:  # The fast output extra isn't installed.
+    orjson = None  # type: ignore[assignment]
+
+
+def dumps(value, fast=True) -> bytes:
+    """Encode value as a line of JSON, with orjson when fast is set."""
+    if fast:
+        return orjson.dumps(value, option=orjson.OPT_APPEND_NEWLINE)
+    # What singer.format_message does.
+    return (simplejson.dumps(value, use_decimal=True) + "\n").encode()
+
+
+class MessageWriter:
+    """Writes RECORD messages to stdout in large buffered writes.
+
+    singer.write_message formats every message with simplejson and flushes
+    stdout after each line. The writer encodes messages with orjson when it
+    is installed and collects them until buffer_size bytes are pending. The
+    buffer must be flushed before any other message is written to stdout,
+    which the streams do before their SCHEMA and STATE messages.
+
+    orjson can't write Decimal values as exact numbers, so with exact_decimals
+    set, or without orjson, messages are encoded the way singer.write_message
+    does and only the buffering applies.
+    """
+
+    def __init__(self, buffer_size=1024 * 1024, exact_decimals=False, stream=None):
+        self.buffer_size = buffer_size
+        self.stream = stream
+        self.fast_encoder = orjson is not None and not exact_decimals
+        self._pending = []
+        self._pending_bytes = 0
+
+    def write(self, message):
+        line = dumps(message.asdict(), self.fast_encoder)
+        self._pending.append(line)
+        self._pending_bytes += len(line)
+        if self._pending_bytes >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        data = b"".join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        stream = self.stream or sys.stdout
+        # Messages written through the text layer come first.
+        stream.flush()
+        if hasattr(stream, "buffer"):
+            stream.buffer.write(data)
+            stream.buffer.flush()
+        else:
+            stream.write(data.decode())
+            stream.flush()
@@ -0,0 +1,147 @@
+"""Pipelined conversion of raw Braintree objects on a process pool."""
+import io
+import multiprocessing
+import pickle
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable
+
+from braintree import BraintreeGateway
+
+from tap_braintree.serializer import RecordSerializer
+
+_DONE = object()
+
+# Serializers of a worker process by braintree_objects and exact_decimals,
+# kept across batches so their cached field plans are reused.
+_serializers: Dict[tuple, RecordSerializer] = {}
+
+
+class _RecordPickler(pickle.Pickler):
+    """Pickles raw records without the gateway every Braintree resource holds.
+
+    The gateway carries the API configuration and HTTP session, none of which
+    the conversion needs, so it is replaced by None.
+    """
+
+    dispatch_table = {BraintreeGateway: lambda gateway: (type(None), ())}
+
+
+def dump_records(records: list) -> bytes:
+    buffer = io.BytesIO()
+    _RecordPickler(buffer, pickle.HIGHEST_PROTOCOL).dump(records)
+    return buffer.getvalue()
+
+
+def create_process_pool(workers) -> ProcessPoolExecutor:
+    """Return a pool of conversion processes for every stream of a tap.
+
+    The workers are started with forkserver, or spawn where that isn't
+    available, since forking copies the locks of the tap's threads in
+    whatever state they are.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    method = "forkserver" if "forkserver" in methods else "spawn"
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context(method)
+    )
+
+
+def _convert_batch(
+    stream_class, braintree_objects, projection, exact_decimals, payload: bytes
+) -> list:
+    key = (braintree_objects, exact_decimals)
+    serializer = _serializers.get(key)
+    if serializer is None:
+        serializer = _serializers[key] = RecordSerializer(
+            braintree_objects, exact_decimals=exact_decimals
+        )
+    return [
+        stream_class.convert_record(serializer, record, projection)
+        for record in pickle.loads(payload)
+    ]
+
+
+class RecordPipeline:
+    """Fetches records on an I/O thread and converts them on a process pool.
+
+    The fetch thread reads raw records from the window, pickles them in
+    batches of batch_size and puts them on a queue of at most queue_size
+    batches. The consuming thread submits the batches to the conversion
+    processes, keeping at most queue_size batches in flight, and yields the
+    converted records in their original order. Both bounds apply backpressure
+    to the API requests when the consumer falls behind.
+
+    The executor is shared by the streams and partitions of a tap, see
+    create_process_pool, and is shut down by its owner.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        stream_class,
+        braintree_objects,
+        projection,
+        batch_size=200,
+        queue_size=4,
+        exact_decimals=False,
+    ):
+        self.executor = executor
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.conversion = (stream_class, braintree_objects, projection, exact_decimals)
+
+    def convert(self, records: Iterable) -> Iterable[dict]:
+        """Yield the converted form of every record, in order."""
+        batches: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stopped = threading.Event()
+        fetcher = threading.Thread(
+            target=self._fetch,
+            args=(iter(records), batches, stopped),
+            name="record-fetch",
+            daemon=True,
+        )
+        fetcher.start()
+
+        pending: deque = deque()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is _DONE:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+                pending.append(
+                    self.executor.submit(_convert_batch, *self.conversion, batch)
+                )
+                if len(pending) >= self.queue_size:
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            stopped.set()
+            for future in pending:
+                future.cancel()
+            # Unblock the fetch thread if it is waiting on a full queue.
+            while fetcher.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def _fetch(self, records, batches, stopped):
+        try:
+            while not stopped.is_set():
+                batch = list(islice(records, self.batch_size))
+                if not batch:
+                    break
+                batches.put(dump_records(batch))
+            result = _DONE
+        except Exception as e:
+            result = e
+        if not stopped.is_set():
+            batches.put(result)
@@ -0,0 +1,140 @@
+"""Sampling profiler for investigating slow syncs in place."""
+import marshal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+# (filename, first line, function name), the way pstats identifies functions.
+Function = Tuple[str, int, str]
+
+
+class SamplingProfiler:
+    """Wall clock profiler that samples the stacks of every thread.
+
+    A background thread wakes up every interval seconds and records the
+    stack of each other thread, so the profiled code runs unmodified and the
+    overhead stays the same however hot the code is. Blocking calls, such as
+    waiting for an API response, show up like CPU bound ones.
+
+    With min_window_seconds set, threads are only sampled while one of the
+    windows reported through window_started has been running for at least
+    that long, so fast windows don't pay for the profiler at all.
+
+    The samples are written as collapsed stacks, one "frame;frame;... count"
+    line per stack as flamegraph.pl and speedscope read them, or as a pstats
+    file when the output path ends in ".pstats".
+    """
+
+    def __init__(self, interval: float = 0.01, min_window_seconds: float = 0):
+        self.interval = interval
+        self.min_window_seconds = min_window_seconds
+        self.samples: Counter = Counter()
+        self._windows: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def window_started(self, key: str):
+        with self._lock:
+            self._windows[key] = time.monotonic()
+
+    def window_finished(self, key: str):
+        with self._lock:
+            self._windows.pop(key, None)
+
+    @property
+    def sampling(self) -> bool:
+        if not self.min_window_seconds:
+            return True
+        with self._lock:
+            started = min(self._windows.values(), default=None)
+        return (
+            started is not None
+            and time.monotonic() - started >= self.min_window_seconds
+        )
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if self.sampling:
+                self.sample()
+
+    def sample(self):
+        """Record the current stack of every thread but the profiler's own."""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples[(names.get(ident, str(ident)), tuple(stack))] += 1
+
+    def write(self, path: str):
+        if path.endswith(".pstats"):
+            self.write_pstats(path)
+        else:
+            self.write_collapsed(path)
+
+    def write_collapsed(self, path: str):
+        with open(path, "w") as f:
+            for (thread, stack), count in sorted(self.samples.items()):
+                frames = ";".join(
+                    [thread]
+                    + [
+                        f"{function} ({filename}:{line})"
+                        for filename, line, function in stack
+                    ]
+                )
+                f.write(f"{frames} {count}\n")
+
+    def write_pstats(self, path: str):
+        """Write the samples in the format pstats.Stats loads.
+
+        Times are the number of samples times the interval. Call counts are
+        sample counts too, since a sampling profiler doesn't see calls.
+        """
+        own: Counter = Counter()
+        cumulative: Counter = Counter()
+        callers: Dict[Function, Counter] = {}
+        for (_, stack), count in self.samples.items():
+            if not stack:
+                continue
+            own[stack[-1]] += count
+            for function in set(stack):
+                cumulative[function] += count
+            for caller, callee in set(zip(stack, stack[1:])):
+                callers.setdefault(callee, Counter())[caller] += count
+
+        stats = {}
+        for function, count in cumulative.items():
+            stats[function] = (
+                count,
+                count,
+                own[function] * self.interval,
+                count * self.interval,
+                {
+                    caller: (n, n, 0.0, n * self.interval)
+                    for caller, n in callers.get(function, {}).items()
+                },
+            )
+        with open(path, "wb") as f:
+            marshal.dump(stats, f)
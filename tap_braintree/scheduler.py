@@ -0,0 +1,144 @@
+"""Rate limiting and retries for the Braintree API requests of the tap."""
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from braintree.exceptions.http.connection_error import (
+    ConnectionError as BraintreeConnectionError,
+)
+from braintree.exceptions.http.timeout_error import (
+    TimeoutError as BraintreeTimeoutError,
+)
+from braintree.exceptions.server_error import ServerError
+from braintree.exceptions.too_many_requests_error import TooManyRequestsError
+
+from tap_braintree.http_session import PooledHttp
+
+RETRYABLE_ERRORS = (
+    TooManyRequestsError,
+    ServerError,
+    BraintreeConnectionError,
+    BraintreeTimeoutError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+)
+# Throttling, server errors and maintenance. Maintenance that outlasts the
+# retries raises DownForMaintenanceError, which BraintreeStream waits out.
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+TOO_MANY_REQUESTS = 429
+
+
+class RetriesExhaustedError(Exception):
+    """A request or window still failed after all its retries."""
+
+
+class RequestScheduler:
+    """Token bucket shared by every request the tap makes.
+
+    Requests are let through at up to requests_per_second, with bursts of up
+    to one second's worth. When Braintree answers with TooManyRequests the
+    rate is halved, and it recovers by a twentieth of the budget with every
+    successful request. Without a budget requests are not limited, but
+    retries still back off exponentially with jitter.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: Optional[float] = None,
+        max_retries: int = 5,
+        backoff_seconds: float = 1,
+        max_backoff_seconds: float = 60,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.max_rate = requests_per_second
+        self.rate = requests_per_second
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.retries = 0
+        self.throttled = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = max(1.0, requests_per_second or 0)
+        self._updated = clock()
+
+    def acquire(self):
+        """Wait until the budget allows another request."""
+        if not self.rate:
+            return
+
+        with self._lock:
+            now = self._clock()
+            capacity = max(1.0, self.rate)
+            self._tokens = min(
+                capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            self._sleep(wait)
+
+    def backoff(self, attempt: int) -> float:
+        """Return the delay before retry number attempt, starting at 1."""
+        delay = min(
+            self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1)
+        )
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def wait(self, attempt: int):
+        with self._lock:
+            self.retries += 1
+        self._sleep(self.backoff(attempt))
+
+    def record_throttled(self):
+        with self._lock:
+            self.throttled += 1
+            if self.rate:
+                self.rate = max(self.max_rate / 20, self.rate / 2)
+
+    def record_success(self):
+        if self.rate and self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class ScheduledHttp(PooledHttp):
+    """Braintree HTTP strategy that sends every request through a scheduler.
+
+    Requests wait for the scheduler's budget and are retried with backoff on
+    connection errors, timeouts, throttling and server errors. Once retries
+    run out, the last response or error is handed back to the SDK as usual.
+    """
+
+    def __init__(self, config, environment=None, scheduler=None, session=None):
+        super().__init__(config, environment, session=session)
+        self.scheduler = scheduler or RequestScheduler()
+
+    def http_do(self, http_verb, path, headers, request_body):
+        attempt = 0
+        while True:
+            self.scheduler.acquire()
+            try:
+                status, response_body = super().http_do(
+                    http_verb, path, headers, request_body
+                )
+            except RETRYABLE_ERRORS:
+                if attempt >= self.scheduler.max_retries:
+                    raise
+            else:
+                if status == TOO_MANY_REQUESTS:
+                    self.scheduler.record_throttled()
+                elif status not in RETRYABLE_STATUSES:
+                    self.scheduler.record_success()
+                    return [status, response_body]
+                if attempt >= self.scheduler.max_retries:
+                    return [status, response_body]
+
+            attempt += 1
+            self.scheduler.wait(attempt)
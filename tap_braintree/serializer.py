@@ -0,0 +1,286 @@
+"""Single pass conversion of Braintree objects into flattened record dicts."""
+import types
+from datetime import datetime, date
+from decimal import Decimal
+from itertools import islice
+
+from flatten_json import flatten
+
+_MISSING = object()
+# Converted catalog items kept by a serializer, see RecordSerializer.convert_item.
+MAX_CONVERTED_ITEMS = 10000
+# Formatted timestamps kept by a serializer before its cache starts over.
+MAX_FORMATTED_TIMESTAMPS = 100000
+
+ARRAY = "array"
+DECIMAL = "decimal"
+DATETIME = "datetime"
+DATE = "date"
+OBJECT = "object"
+PLAIN = "plain"
+
+
+def _flatten_into(out, key, value):
+    """Write value into out the way flatten_json.flatten writes a non-root key."""
+    if not value:
+        out[key] = value
+    elif isinstance(value, dict):
+        for child_key in value:
+            _flatten_into(out, f"{key}_{child_key}", value[child_key])
+    elif isinstance(value, (list, set, tuple)):
+        for index, item in enumerate(value):
+            _flatten_into(out, f"{key}_{index}", item)
+    else:
+        out[key] = value
+
+
+class RecordSerializer:
+    """Converts Braintree objects to the dicts BraintreeStream.object_to_dict used
+    to build with flatten_json, in a single pass over each object.
+
+    The kind of every value (array, Decimal, datetime, date, nested object or
+    plain) is resolved once per value type, and the attribute plan once per
+    object class, attribute list, ignored keys and projection. Nested objects
+    are written straight into the parent record under their prefixed keys
+    instead of being built as separate dicts and flattened again.
+
+    With a catalog, see CatalogIndex, the add-ons and discounts of records
+    are converted once per distinct content and the result is reused.
+
+    Datetimes and dates are written as UTC timestamps like
+    "2021-03-04 05:06:07+00:00". The API returns naive UTC datetimes, and
+    the same timestamps recur within and across records, so their formatted
+    form is cached. Decimals are written as floats, or left as Decimal with
+    exact_decimals, which the Singer message writer serializes as exact JSON
+    numbers.
+    """
+
+    def __init__(self, braintree_objects, catalog=None, exact_decimals=False):
+        self.braintree_objects = braintree_objects
+        self.catalog = catalog
+        self.exact_decimals = exact_decimals
+        self._kinds = {}
+        self._plans = {}
+        self._converted = {}
+        self._timestamps = {}
+
+    def to_dict(self, d, ignore_obj, projection=None):
+        """Convert d to a record dict.
+
+        When projection is a set of record keys, top level attributes that can't
+        produce any of those keys are skipped without being read.
+        """
+        try:
+            attributes = d._setattrs
+        except AttributeError:
+            return d
+
+        ignore = frozenset(ignore_obj)
+        out = {}
+        arrays = {}
+        if (
+            self._write_attributes(out, arrays, None, d, attributes, ignore, projection)
+            is None
+        ):
+            return None
+
+        for attr, items in arrays.items():
+            arrays[attr] = [
+                flatten(item)
+                if isinstance(item, dict)
+                else self.convert_item(item, ignore)
+                for item in items
+            ]
+        out.update(arrays)
+        return out
+
+    def convert_item(self, item, ignore):
+        """Convert an element of an array attribute.
+
+        Add-ons and discounts of the catalog are the same handful of objects
+        in thousands of records, differing at most in per-record fields such
+        as quantity. Their conversion is looked up by the item's attribute
+        values and a copy of the earlier result is returned.
+        """
+        if self.catalog is None or not self.catalog.contains(item):
+            return self.to_dict(item, ignore)
+
+        attributes = item._setattrs
+        key = (
+            type(item),
+            tuple(attributes),
+            tuple(getattr(item, attr, _MISSING) for attr in attributes),
+            ignore,
+        )
+        try:
+            converted = self._converted.get(key, _MISSING)
+        except TypeError:
+            # An unhashable attribute value, convert the item as usual.
+            return self.to_dict(item, ignore)
+        if converted is _MISSING:
+            converted = self.to_dict(item, ignore)
+            if len(self._converted) < MAX_CONVERTED_ITEMS:
+                self._converted[key] = converted
+        return dict(converted) if converted is not None else None
+
+    def kind(self, value_type):
+        kind = self._kinds.get(value_type)
+        if kind is None:
+            if issubclass(value_type, (list, set, tuple, types.GeneratorType)):
+                kind = ARRAY
+            elif issubclass(value_type, Decimal):
+                kind = DECIMAL
+            elif issubclass(value_type, datetime):
+                kind = DATETIME
+            elif issubclass(value_type, date):
+                kind = DATE
+            elif issubclass(value_type, self.braintree_objects):
+                kind = OBJECT
+            else:
+                kind = PLAIN
+            self._kinds[value_type] = kind
+        return kind
+
+    def plan(self, d, attributes, ignore, projection=None):
+        """Return (attr, is_addresses, is_ignored) for every attribute of d that
+        is needed for the projected keys."""
+        key = (type(d), tuple(attributes), ignore, projection)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = tuple(
+                (attr, attr == "addresses", attr in ignore)
+                for attr in attributes
+                if projection is None or self.is_projected(attr, projection)
+            )
+            self._plans[key] = plan
+        return plan
+
+    def format_timestamp(self, value) -> str:
+        """Return str(value) as a UTC datetime, the way flatten_json's input
+        was built with replace(tzinfo=pytz.UTC)."""
+        text = self._timestamps.get(value)
+        if text is not None:
+            return text
+
+        if not isinstance(value, datetime):
+            text = f"{value} 00:00:00+00:00"
+        elif value.tzinfo is None:
+            text = f"{value}+00:00"
+        else:
+            # Aware values that are equal in UTC may differ in wall time, so
+            # they aren't cached.
+            return f"{value.replace(tzinfo=None)}+00:00"
+
+        if len(self._timestamps) >= MAX_FORMATTED_TIMESTAMPS:
+            self._timestamps.clear()
+        self._timestamps[value] = text
+        return text
+
+    @staticmethod
+    def is_projected(attr, projection):
+        """Whether attr can produce one of the keys in projection."""
+        if attr == "addresses":
+            return any(key.startswith("address_") for key in projection)
+        return any(key == attr or key.startswith(f"{attr}_") for key in projection)
+
+    def _write_attributes(
+        self, out, arrays, prefix, d, attributes, ignore, projection=None
+    ):
+        """Write the flat attributes of d into out and collect its arrays.
+
+        Returns None if d is missing one of its attributes, otherwise whether any
+        flat key was written.
+        """
+        wrote = False
+        kinds = self._kinds
+        timestamps = self._timestamps
+        plan = self.plan(d, attributes, ignore, projection)
+        for attr, is_addresses, is_ignored in plan:
+            value = getattr(d, attr, _MISSING)
+            if value is _MISSING:
+                return None
+
+            if is_addresses:
+                if self._write_addresses(out, prefix, value, ignore):
+                    wrote = True
+                continue
+
+            value_type = type(value)
+            kind = kinds.get(value_type) or self.kind(value_type)
+            if kind is ARRAY:
+                items = list(value)
+                if items:
+                    arrays[attr] = items
+                continue
+            if is_ignored:
+                continue
+
+            key = attr if prefix is None else f"{prefix}_{attr}"
+            wrote = True
+            if kind is PLAIN:
+                _flatten_into(out, key, value)
+            elif kind is DATETIME or kind is DATE:
+                out[key] = timestamps.get(value) or self.format_timestamp(value)
+            else:
+                self._write_value(out, key, value, kind, ignore)
+
+        return wrote
+
+    def _write_addresses(self, out, prefix, addresses, ignore) -> bool:
+        """Write the first address with a country_code_alpha2, or else the first
+        address, as address_ keys. Returns whether any key was written."""
+        if not addresses:
+            return False
+
+        valid_address = next(
+            (
+                addr
+                for addr in addresses
+                if getattr(addr, "country_code_alpha2", None) is not None
+            ),
+            addresses[0],
+        )
+        wrote = False
+        for address_attr in valid_address._setattrs:
+            address_value = getattr(valid_address, address_attr, _MISSING)
+            key = f"address_{address_attr}"
+            if address_value is _MISSING or key in ignore:
+                continue
+            if prefix is not None:
+                key = f"{prefix}_{key}"
+            _flatten_into(out, key, address_value)
+            wrote = True
+        return wrote
+
+    def _write_value(self, out, key, value, kind, ignore):
+        """Write a decimal or nested object value under key."""
+        if kind is DECIMAL:
+            out[key] = value if self.exact_decimals else float(value)
+        else:
+            self._write_object(out, key, value, ignore)
+
+    def _write_object(self, out, prefix, d, ignore):
+        """Write the flattened form of a nested object under prefix."""
+        try:
+            attributes = d._setattrs
+        except AttributeError:
+            _flatten_into(out, prefix, d)
+            return
+
+        size = len(out)
+        arrays = {}
+        wrote = self._write_attributes(out, arrays, prefix, d, attributes, ignore)
+        if wrote is None:
+            for key in list(islice(out, size, None)):
+                del out[key]
+            out[prefix] = None
+        elif not wrote and not arrays:
+            out[prefix] = {}
+        else:
+            for attr, items in arrays.items():
+                for index, item in enumerate(items):
+                    key = f"{prefix}_{attr}_{index}"
+                    if isinstance(item, dict):
+                        _flatten_into(out, key, item)
+                    else:
+                        self._write_object(out, key, item, ignore)
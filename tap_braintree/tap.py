@@ -1,18 +1,38 @@
 """braintree tap class."""
 
-from typing import List
+import copy
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from threading import Lock
+from typing import TYPE_CHECKING, List, Optional
+from urllib.parse import urlparse
 
+import singer
 from singer_sdk import Tap, Stream
 from singer_sdk import typing as th  # JSON schema typing helpers
+from singer_sdk.helpers._classproperty import classproperty
 
+from tap_braintree.client import BraintreeStream
+from tap_braintree.output import MessageWriter, dumps
+from tap_braintree.profiler import SamplingProfiler
 from tap_braintree.streams import (
-    BraintreeStream,
     TransactionsStream,
     SubscriptionsStream,
     PlansStream,
     CustomersStream,
 )
 
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+    import braintree
+
+    from tap_braintree.catalog_index import CatalogIndex
+    from tap_braintree.scheduler import RequestScheduler
+
+
 STREAM_TYPES = [
     TransactionsStream,
     SubscriptionsStream,
@@ -25,14 +45,359 @@ class TapBraintree(Tap):
     """braintree tap class."""
     name = "tap-braintree"
 
+    _request_scheduler: Optional["RequestScheduler"] = None
+    _gateway: Optional["braintree.BraintreeGateway"] = None
+    _profiler: Optional[SamplingProfiler] = None
+    _catalog_index: Optional["CatalogIndex"] = None
+    _message_writer: Optional[MessageWriter] = None
+    _process_pool: Optional["ProcessPoolExecutor"] = None
+
     config_jsonschema = th.PropertiesList(
         th.Property("merchant_id", th.StringType, required=True),
         th.Property("public_key", th.StringType, required=True),
         th.Property("private_key", th.StringType, required=True),
         th.Property("start_date", th.DateTimeType, required=True),
         th.Property("sync_state", th.StringType, required=True),
+        th.Property("parallel_streams", th.BooleanType),
+        th.Property("requests_per_second", th.NumberType),
+        th.Property("max_request_retries", th.IntegerType),
+        th.Property("retry_backoff_seconds", th.NumberType),
+        th.Property("max_retry_backoff_seconds", th.NumberType),
+        th.Property("max_window_retries", th.IntegerType),
+        th.Property("http_pool_size", th.IntegerType),
+        th.Property("api_url", th.StringType),
+        th.Property("max_parallel_windows", th.IntegerType),
+        th.Property("pipeline_workers", th.IntegerType),
+        th.Property("pipeline_batch_size", th.IntegerType),
+        th.Property("pipeline_queue_size", th.IntegerType),
+        th.Property("adaptive_windows", th.BooleanType),
+        th.Property("id_first_fetch", th.BooleanType),
+        th.Property("prefetch_pages", th.IntegerType),
+        th.Property("max_buffered_records", th.IntegerType),
+        th.Property("exact_decimals", th.BooleanType),
+        th.Property("fast_output", th.BooleanType),
+        th.Property("output_buffer_bytes", th.IntegerType),
+        th.Property("batch_output_dir", th.StringType),
+        th.Property("batch_max_records", th.IntegerType),
+        th.Property("checkpoint_interval_seconds", th.NumberType),
+        th.Property("partition_months", th.IntegerType),
+        th.Property("resync_recent_partition_days", th.NumberType),
+        th.Property("record_fingerprint_dir", th.StringType),
+        th.Property("fingerprint_ttl_days", th.NumberType),
+        th.Property("force_full_emit", th.BooleanType),
+        th.Property("min_window_hours", th.NumberType),
+        th.Property("max_window_hours", th.NumberType),
+        th.Property("customer_cache_size", th.IntegerType),
+        th.Property("customer_cache_path", th.StringType),
+        th.Property("customer_cache_ttl_hours", th.NumberType),
+        th.Property("customer_prefetch_batch_size", th.IntegerType),
+        th.Property("profile_output", th.StringType),
+        th.Property("profile_interval_ms", th.NumberType),
+        th.Property("profile_min_window_seconds", th.NumberType),
     ).to_dict()
 
+    def __init__(self, *args, **kwargs):
+        # Serializes the messages of streams that sync in parallel.
+        self.message_lock = Lock()
+        self._setup_lock = Lock()
+        # Held while the catalog loads, so that streams starting at the same
+        # time wait for it instead of loading it again.
+        self._catalog_lock = Lock()
+        super().__init__(*args, **kwargs)
+
     def discover_streams(self) -> List[Stream]:
         """Return a list of discovered streams."""
         return [stream_class(tap=self) for stream_class in STREAM_TYPES]
+
+    @property
+    def request_scheduler(self) -> "RequestScheduler":
+        """The scheduler every API request of every stream goes through."""
+        from tap_braintree.scheduler import RequestScheduler
+
+        with self._setup_lock:
+            if self._request_scheduler is None:
+                self._request_scheduler = RequestScheduler(
+                    requests_per_second=self.config.get("requests_per_second"),
+                    max_retries=self.config.get("max_request_retries", 5),
+                    backoff_seconds=self.config.get("retry_backoff_seconds", 1),
+                    max_backoff_seconds=self.config.get(
+                        "max_retry_backoff_seconds", 60
+                    ),
+                )
+        return self._request_scheduler
+
+    @property
+    def environment(self) -> "braintree.Environment":
+        """Braintree production, or the API at api_url, e.g. a local stand-in."""
+        import braintree
+
+        api_url = self.config.get("api_url")
+        if not api_url:
+            return braintree.Environment.Production
+
+        url = urlparse(api_url)
+        is_ssl = url.scheme == "https"
+        return braintree.Environment(
+            "custom",
+            url.hostname,
+            str(url.port or (443 if is_ssl else 80)),
+            "",
+            is_ssl,
+            True if is_ssl else None,
+        )
+
+    @property
+    def gateway(self) -> "braintree.BraintreeGateway":
+        """The gateway shared by all streams and their worker threads.
+
+        Its requests go through the request scheduler over one pooled
+        keep-alive session. braintree and the modules wrapping its HTTP
+        requests are imported here rather than with the tap, since --about
+        and --discover never get this far.
+        """
+        import braintree
+
+        from tap_braintree.http_session import create_session
+        from tap_braintree.scheduler import ScheduledHttp
+
+        scheduler = self.request_scheduler
+        with self._setup_lock:
+            if self._gateway is None:
+                http_strategy = partial(
+                    ScheduledHttp,
+                    scheduler=scheduler,
+                    session=create_session(self.config.get("http_pool_size", 10)),
+                )
+                self._gateway = braintree.BraintreeGateway(
+                    braintree.Configuration(
+                        self.environment,
+                        merchant_id=self.config["merchant_id"],
+                        public_key=self.config["public_key"],
+                        private_key=self.config["private_key"],
+                        http_strategy=http_strategy,
+                    )
+                )
+        return self._gateway
+
+    @property
+    def parallel_streams(self) -> bool:
+        return self.config.get("parallel_streams", False)
+
+    @property
+    def catalog_index(self) -> "CatalogIndex":
+        """The merchant's plans, add-ons and discounts, loaded on first use."""
+        from tap_braintree.catalog_index import CatalogIndex
+
+        gateway = self.gateway
+        with self._catalog_lock:
+            if self._catalog_index is None:
+                self._catalog_index = CatalogIndex.load(gateway)
+                self.logger.info(
+                    "Loaded {} plans, {} add-ons and {} discounts".format(
+                        len(self._catalog_index.plans),
+                        len(self._catalog_index.add_ons),
+                        len(self._catalog_index.discounts),
+                    )
+                )
+        return self._catalog_index
+
+    @property
+    def profiler(self) -> Optional[SamplingProfiler]:
+        """The sampling profiler of the sync, when profile_output is set."""
+        with self._setup_lock:
+            if self._profiler is None and self.config.get("profile_output"):
+                self._profiler = SamplingProfiler(
+                    interval=self.config.get("profile_interval_ms", 10) / 1000,
+                    min_window_seconds=self.config.get(
+                        "profile_min_window_seconds", 0
+                    ),
+                )
+        return self._profiler
+
+    @property
+    def message_writer(self) -> Optional[MessageWriter]:
+        """The buffered RECORD message writer, when fast_output is enabled."""
+        with self._setup_lock:
+            if self._message_writer is None and self.config.get("fast_output"):
+                self._message_writer = MessageWriter(
+                    buffer_size=self.config.get("output_buffer_bytes", 1024 * 1024),
+                    exact_decimals=self.config.get("exact_decimals", False),
+                )
+                if not self._message_writer.fast_encoder:
+                    self.logger.info(
+                        "Writing records with simplejson, orjson is not installed "
+                        "or exact_decimals is set"
+                    )
+        return self._message_writer
+
+    @property
+    def process_pool(self) -> "ProcessPoolExecutor":
+        """The conversion processes of pipeline_workers, shared by all streams
+        and partitions and shut down at the end of the sync."""
+        from tap_braintree.pipeline import create_process_pool
+
+        with self._setup_lock:
+            if self._process_pool is None:
+                self._process_pool = create_process_pool(
+                    self.config.get("pipeline_workers", 0)
+                )
+        return self._process_pool
+
+    def close_process_pool(self):
+        with self._setup_lock:
+            if self._process_pool is not None:
+                self._process_pool.shutdown()
+                self._process_pool = None
+
+    def flush_messages(self):
+        """Write out the RECORD messages the message writer still buffers."""
+        if self.message_writer:
+            self.message_writer.flush()
+
+    def flush_messages_locked(self):
+        with self.message_lock:
+            self.flush_messages()
+
+    def write_raw_messages(self, messages: List[dict]):
+        """Write messages singer-python has no class for, such as BATCH. The
+        caller holds message_lock."""
+        self.flush_messages()
+        for message in messages:
+            sys.stdout.write(dumps(message, fast=False).decode())
+        sys.stdout.flush()
+
+    @classproperty
+    def cli(cls):
+        """The SDK's command line, with syncs run by sync.
+
+        Tap.sync_all is final, so the command's callback is replaced with one
+        that handles the sync itself and leaves every other mode to the SDK.
+        """
+        command = Tap.__dict__["cli"].fget(cls)
+        sdk_callback = command.callback
+
+        def callback(config=(), state=None, catalog=None, **options):
+            if any(options[name] for name in ("version", "about", "discover", "test")):
+                sdk_callback(config=config, state=state, catalog=catalog, **options)
+                return
+
+            cls.print_version(print_fn=cls.logger.info)
+            config_files = [Path(path) for path in config if path != "ENV"]
+            for path in config_files:
+                if not path.is_file():
+                    raise FileNotFoundError(
+                        f"Could not locate config file at '{path}'."
+                        "Please check that the file exists."
+                    )
+            tap = cls(
+                config=config_files or None,
+                state=state,
+                catalog=catalog,
+                parse_env_config="ENV" in config,
+            )
+            tap.sync()
+
+        command.callback = callback
+        return command
+
+    def sync(self):
+        """Sync all streams, profiling the sync when profile_output is set.
+
+        Use this rather than sync_all, which syncs the streams one after
+        another without profiling and leaves buffered messages unwritten.
+        """
+        try:
+            self.sync_profiled()
+        finally:
+            self.tear_down_sync()
+
+    def tear_down_sync(self):
+        """Finish the streams, shut down the process pool and write out the
+        buffered messages. Every step runs even if an earlier one fails, and
+        the first error is raised once all of them ran."""
+        steps = [stream.finish_sync for stream in self.streams.values()]
+        steps += [self.close_process_pool, self.flush_messages_locked]
+        error = None
+        for step in steps:
+            try:
+                step()
+            except Exception as e:
+                self.logger.exception(f"Failed to tear down the sync: {e}")
+                error = error or e
+        if error is not None:
+            raise error
+
+    def sync_profiled(self):
+        profiler = self.profiler
+        if profiler is None:
+            self.sync_streams()
+            return
+
+        profiler.start()
+        try:
+            self.sync_streams()
+        finally:
+            profiler.stop()
+            profiler.write(self.config["profile_output"])
+            self.logger.info(
+                f"Wrote {sum(profiler.samples.values())} profile samples to "
+                f"{self.config['profile_output']}"
+            )
+
+    def sync_streams(self):
+        """Sync all streams, one after another or all at once.
+
+        With parallel_streams enabled every selected stream is synced on its
+        own thread. Streams write their messages under message_lock, so each
+        stream's SCHEMA and RECORD messages keep their order, and every STATE
+        message is built from the bookmarks each stream last wrote after its
+        records, see write_stream_state.
+        """
+        if not self.parallel_streams:
+            self.sync_all()
+            return
+
+        # What Tap.sync_all does before syncing the streams. These methods are
+        # private, so singer-sdk is pinned to the version they are checked
+        # against, see test_private_sdk_methods_exist.
+        self._reset_state_progress_markers()
+        self._set_compatible_replication_methods()
+        self._base_state = copy.deepcopy(self.state)
+        self._stream_states = {}
+
+        streams = []
+        for stream in self.streams.values():
+            if not stream.selected and not stream.has_selected_descendents:
+                self.logger.info(f"Skipping deselected stream '{stream.name}'.")
+            elif not stream.parent_stream_type:
+                streams.append(stream)
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, len(streams)), thread_name_prefix="stream"
+        ) as executor:
+            futures = [executor.submit(self.sync_stream, stream) for stream in streams]
+            for future in futures:
+                future.result()
+
+    def sync_stream(self, stream: BraintreeStream):
+        try:
+            stream.sync()
+            stream.finalize_state_progress_markers()
+            stream._write_state_message()
+        finally:
+            # On the stream's thread, which owns its SQLite connections.
+            stream.finish_sync()
+
+    def write_stream_state(self, stream_name: str, stream_state: dict):
+        """Write a STATE message with the latest bookmarks of stream_name.
+
+        Used when streams sync in parallel. Other streams are included with the
+        state they last wrote, which only covers records already written.
+        """
+        with self.message_lock:
+            self._stream_states[stream_name] = stream_state
+            bookmarks = {**self._base_state.get("bookmarks", {}), **self._stream_states}
+            self.flush_messages()
+            singer.write_message(
+                singer.StateMessage(value={**self._base_state, "bookmarks": bookmarks})
+            )
@@ -0,0 +1,487 @@
+"""Local stand-in for the Braintree API, for offline end to end runs.
+
+Serves the search endpoints the tap uses (advanced_search_ids and the
+advanced_search id pages for transactions, subscriptions and customers, and
+the plans, add-ons and discounts lists) from generated records, or from
+recorded fixtures replayed as templates. Point the tap at it with the api_url
+setting::
+
+    python -m tap_braintree.tests.fake_braintree --port 8080 \\
+        --transactions 50000 --latency-ms 20
+    # config.json: {"api_url": "http://localhost:8080", ...}
+
+Fixtures are JSON files named after the stream (transactions.json, ...)
+holding a list of raw records as the API returns them, with ISO formatted
+dates. They are cycled through to reach the requested number of records,
+with fresh ids and creation dates.
+"""
+import argparse
+import bisect
+import copy
+import json
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape
+
+from braintree.util.xml_util import XmlUtil
+
+# Search path -> (stream, collection tag, record tag).
+COLLECTIONS = {
+    "transactions": ("transactions", "credit-card-transactions", "transaction"),
+    "subscriptions": ("subscriptions", "subscriptions", "subscription"),
+    "customers": ("customers", "customers", "customer"),
+}
+SEARCH_PATH = re.compile(
+    r"^/merchants/[^/]+/(transactions|subscriptions|customers)"
+    r"/advanced_search(_ids)?$"
+)
+CATALOG_PATH = re.compile(r"^/merchants/[^/]+/(plans|add_ons|discounts)/?$")
+ISO_DATETIME = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}")
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def to_xml(tag: str, value) -> str:
+    """Render value as a Braintree API XML node."""
+    tag = tag.replace("_", "-")
+    if isinstance(value, dict):
+        children = "".join(to_xml(key, child) for key, child in value.items())
+        return f"<{tag}>{children}</{tag}>"
+    if isinstance(value, list):
+        items = "".join(to_xml("item", item) for item in value)
+        return f'<{tag} type="array">{items}</{tag}>'
+    if value is None:
+        return f'<{tag} nil="true"/>'
+    if isinstance(value, bool):
+        return f'<{tag} type="boolean">{str(value).lower()}</{tag}>'
+    if isinstance(value, int):
+        return f'<{tag} type="integer">{value}</{tag}>'
+    if isinstance(value, datetime):
+        return f'<{tag} type="datetime">{value:%Y-%m-%dT%H:%M:%SZ}</{tag}>'
+    if isinstance(value, date):
+        return f'<{tag} type="date">{value:%Y-%m-%d}</{tag}>'
+    return f"<{tag}>{escape(str(value))}</{tag}>"
+
+
+def in_range(value, low, high) -> bool:
+    """Whether a record date is within a search range."""
+    if value is None:
+        return False
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return (low is None or low <= value) and (high is None or value <= high)
+
+
+def parse_dates(value):
+    """Turn the ISO dates of a JSON fixture back into date and datetime."""
+    if isinstance(value, dict):
+        return {key: parse_dates(child) for key, child in value.items()}
+    if isinstance(value, list):
+        return [parse_dates(item) for item in value]
+    if isinstance(value, str) and ISO_DATETIME.match(value):
+        return datetime.fromisoformat(value.replace("Z", "")[:19])
+    if isinstance(value, str) and ISO_DATE.match(value):
+        return date.fromisoformat(value)
+    return value
+
+
+def generate_transaction(i: int, created_at: datetime, customers: int) -> dict:
+    customer_id = f"cus{i % customers}"
+    amount = Decimal(1000 + i % 9000) / 100
+    settled_at = created_at + timedelta(hours=6)
+    record = {
+        "id": f"tx{i:08d}",
+        "global_id": f"dHJhbnNhY3Rpb25f{i:08d}",
+        "type": "sale",
+        "status": "settled",
+        "amount": amount,
+        "tax_amount": Decimal("0.00"),
+        "currency_iso_code": "USD",
+        "merchant_account_id": "merchant_usd",
+        "order_id": f"order-{i}",
+        "plan_id": "monthly",
+        "subscription_id": f"sub{i % 5000}",
+        "processor_response_code": "1000",
+        "processor_response_text": "Approved",
+        "created_at": created_at,
+        "updated_at": settled_at,
+        "refund_ids": [],
+        "custom_fields": {"plan_id": "monthly", "email": f"{customer_id}@example.com"},
+        # Every tenth transaction has no billing country and needs the
+        # customer address backfill.
+        "billing": {
+            "id": None,
+            "country_code_alpha2": None if i % 10 == 0 else "US",
+            "region": None if i % 10 == 0 else "CA",
+            "postal_code": "94107",
+        },
+        "customer": {
+            "id": customer_id,
+            "email": f"{customer_id}@example.com",
+            "first_name": "Jane",
+            "last_name": "Doe",
+        },
+        "credit_card": {
+            "bin": "411111",
+            "last_4": "1111",
+            "card_type": "Visa",
+            "expiration_month": "12",
+            "expiration_year": "2030",
+            "customer_location": "US",
+        },
+        "descriptor": {"name": "ACME*STORE", "phone": None, "url": None},
+        "disbursement_details": {
+            "disbursement_date": settled_at.date(),
+            "settlement_amount": amount,
+            "settlement_currency_iso_code": "USD",
+            "settlement_currency_exchange_rate": Decimal("1"),
+            "funds_held": False,
+            "success": True,
+        },
+        "risk_data": {"id": f"risk{i}", "decision": "Approve"},
+        "add_ons": [
+            {"id": "SaaS_TAX", "name": "SaaS_TAX", "amount": Decimal("1.25")}
+        ],
+        "discounts": [
+            {"id": "welcome", "name": "welcome", "amount": Decimal("2.00")}
+        ],
+        "status_history": [
+            {"status": status, "amount": amount, "timestamp": timestamp}
+            for status, timestamp in (
+                ("authorized", created_at),
+                ("submitted_for_settlement", created_at),
+                ("settled", settled_at),
+            )
+        ],
+        "disputes": [],
+    }
+    if i % 100 == 0:
+        record["disputes"] = [
+            {
+                "id": f"dp{i}",
+                "amount": amount,
+                "status": "open",
+                "reason": "fraud",
+                "received_date": (created_at + timedelta(days=20)).date(),
+                "status_history": [{"status": "open", "timestamp": created_at}],
+            }
+        ]
+    return record
+
+
+def generate_subscription(i: int, created_at: datetime) -> dict:
+    return {
+        "id": f"sub{i:08d}",
+        "plan_id": "monthly",
+        "status": "Active",
+        "price": Decimal("9.99"),
+        "balance": Decimal("0.00"),
+        "created_at": created_at,
+        "updated_at": created_at,
+        "first_billing_date": created_at.date(),
+        "next_billing_date": (created_at + timedelta(days=30)).date(),
+        "billing_day_of_month": created_at.day,
+        "current_billing_cycle": 1,
+        "descriptor": {"name": "ACME*STORE", "phone": None, "url": None},
+        "add_ons": [],
+        "discounts": [{"id": "welcome", "amount": Decimal("1.00")}],
+        "status_history": [
+            {
+                "status": "Active",
+                "balance": Decimal("0.00"),
+                "price": Decimal("9.99"),
+                "timestamp": created_at,
+            }
+        ],
+        "transactions": [],
+    }
+
+
+def generate_customer(i: int, created_at: datetime) -> dict:
+    return {
+        "id": f"cus{i}",
+        "email": f"cus{i}@example.com",
+        "first_name": "Jane",
+        "last_name": "Doe",
+        "created_at": created_at,
+        "updated_at": created_at,
+        "custom_fields": "",
+        "addresses": [
+            {"id": f"a{i}", "country_code_alpha2": "GB", "region": "London"}
+        ],
+    }
+
+
+def generate_plans() -> List[dict]:
+    created_at = datetime(2020, 1, 1)
+    return [
+        {
+            "id": plan_id,
+            "name": plan_id,
+            "price": Decimal(price),
+            "billing_frequency": frequency,
+            "currency_iso_code": "USD",
+            "created_at": created_at,
+            "updated_at": created_at,
+            "add_ons": [],
+            "discounts": [],
+        }
+        for plan_id, price, frequency in (("monthly", "9.99", 1), ("yearly", "99", 12))
+    ]
+
+
+def generate_modifications(kind: str, amounts: Dict[str, str]) -> List[dict]:
+    """Return the add-ons or discounts catalog, by id and amount."""
+    created_at = datetime(2020, 1, 1)
+    return [
+        {
+            "id": id,
+            "name": id,
+            "kind": kind,
+            "amount": Decimal(amount),
+            "never_expires": True,
+            "number_of_billing_cycles": None,
+            "created_at": created_at,
+            "updated_at": created_at,
+        }
+        for id, amount in amounts.items()
+    ]
+
+
+def generate_records(
+    counts: Dict[str, int], start: datetime, end: datetime, fixtures=None
+) -> Dict[str, List[dict]]:
+    """Return counts[stream] records per stream created evenly from start to end.
+
+    With fixtures, the records of a stream are copies of its fixture records
+    in turn, each with a new id and creation date.
+    """
+    fixtures = fixtures or {}
+    customers = max(1, counts.get("customers", 0))
+    generators = {
+        "transactions": lambda i, at: generate_transaction(i, at, customers),
+        "subscriptions": generate_subscription,
+        "customers": generate_customer,
+    }
+    records = {
+        "plans": fixtures.get("plans") or generate_plans(),
+        "add_ons": fixtures.get("add_ons")
+        or generate_modifications("add_on", {"SaaS_TAX": "1.25"}),
+        "discounts": fixtures.get("discounts")
+        or generate_modifications("discount", {"welcome": "2.00"}),
+    }
+    for stream, generate in generators.items():
+        count = counts.get(stream, 0)
+        step = (end - start) / max(1, count)
+        templates = fixtures.get(stream)
+        records[stream] = []
+        for i in range(count):
+            created_at = (start + step * i).replace(microsecond=0)
+            if templates:
+                record = copy.deepcopy(templates[i % len(templates)])
+                record["id"] = f"{record['id']}-{i}"
+                record["created_at"] = created_at
+            else:
+                record = generate(i, created_at)
+            records[stream].append(record)
+    return records
+
+
+def load_fixtures(path) -> Dict[str, List[dict]]:
+    fixtures = {}
+    for stream in (
+        "transactions",
+        "subscriptions",
+        "customers",
+        "plans",
+        "add_ons",
+        "discounts",
+    ):
+        fixture = Path(path) / f"{stream}.json"
+        if fixture.exists():
+            fixtures[stream] = parse_dates(json.loads(fixture.read_text()))
+    return fixtures
+
+
+class FakeBraintree(ThreadingHTTPServer):
+    """HTTP server answering the tap's search requests like Braintree does.
+
+    Every request waits latency seconds before it is answered. Search results
+    hold at most search_limit ids, like the real API truncates large results,
+    and are paged in page_size ids.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        records: Dict[str, List[dict]],
+        address=("127.0.0.1", 0),
+        latency: float = 0.0,
+        page_size: int = 50,
+        search_limit: Optional[int] = None,
+    ):
+        super().__init__(address, FakeBraintreeHandler)
+        self.latency = latency
+        self.page_size = page_size
+        self.search_limit = search_limit
+        self.requests = 0
+        self.catalog_requests = 0
+        self.records = {}
+        self.created_at = {}
+        self.by_id = {}
+        for stream, stream_records in records.items():
+            stream_records = sorted(
+                stream_records,
+                key=lambda record: record.get("created_at") or datetime.min,
+            )
+            self.records[stream] = stream_records
+            self.created_at[stream] = [
+                record.get("created_at") for record in stream_records
+            ]
+            self.by_id[stream] = {record["id"]: record for record in stream_records}
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeBraintree":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def search(self, stream: str, criteria: dict) -> List[dict]:
+        """Return the records of stream matching every search criterion."""
+        criteria = dict(criteria)
+        ids = criteria.pop("ids", None)
+        if ids is not None:
+            ids = ids if isinstance(ids, list) else [ids]
+            records = [
+                self.by_id[stream][id] for id in ids if id in self.by_id[stream]
+            ]
+        elif isinstance(criteria.get("created_at"), dict):
+            window = criteria.pop("created_at")
+            dates = self.created_at[stream]
+            low = bisect.bisect_left(dates, window["min"]) if "min" in window else 0
+            high = (
+                bisect.bisect_right(dates, window["max"])
+                if "max" in window
+                else len(dates)
+            )
+            records = self.records[stream][low:high]
+        else:
+            records = self.records[stream]
+
+        for field, value in criteria.items():
+            if isinstance(value, dict):
+                records = [
+                    record
+                    for record in records
+                    if in_range(record.get(field), value.get("min"), value.get("max"))
+                ]
+        return records
+
+
+class FakeBraintreeHandler(BaseHTTPRequestHandler):
+    server: FakeBraintree
+
+    def do_GET(self):
+        self.respond_to(lambda body: self.catalog())
+
+    def do_POST(self):
+        self.respond_to(self.search)
+
+    def respond_to(self, handle):
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        length = int(self.headers.get("Content-Length") or 0)
+        request = self.rfile.read(length).decode() if length else ""
+        body = handle(XmlUtil.dict_from_xml(request) if request.strip() else {})
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        payload = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def catalog(self):
+        match = CATALOG_PATH.match(self.path)
+        if not match:
+            return None
+        self.server.catalog_requests += 1
+        return to_xml(match.group(1), self.server.records.get(match.group(1), []))
+
+    def search(self, body):
+        match = SEARCH_PATH.match(self.path)
+        if not match:
+            return None
+        stream, collection, tag = COLLECTIONS[match.group(1)]
+        records = self.server.search(stream, body.get("search") or {})
+
+        if match.group(2):
+            ids = [record["id"] for record in records][: self.server.search_limit]
+            return to_xml(
+                "search_results", {"page_size": self.server.page_size, "ids": ids}
+            )
+        items = "".join(to_xml(tag, record) for record in records)
+        return f'<{collection} type="collection">{items}</{collection}>'
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--transactions", type=int, default=10000)
+    parser.add_argument("--subscriptions", type=int, default=1000)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--start", default="2021-01-01")
+    parser.add_argument("--end", default="2021-02-01")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--search-limit", type=int, default=None)
+    parser.add_argument("--fixtures", help="Directory of recorded JSON fixtures.")
+    args = parser.parse_args()
+
+    records = generate_records(
+        {
+            "transactions": args.transactions,
+            "subscriptions": args.subscriptions,
+            "customers": args.customers,
+        },
+        datetime.fromisoformat(args.start),
+        datetime.fromisoformat(args.end),
+        fixtures=load_fixtures(args.fixtures) if args.fixtures else None,
+    )
+    server = FakeBraintree(
+        records,
+        address=(args.host, args.port),
+        latency=args.latency_ms / 1000,
+        page_size=args.page_size,
+        search_limit=args.search_limit,
+    )
+    print(f"Serving fake Braintree API at {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
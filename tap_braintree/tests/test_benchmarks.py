@@ -0,0 +1,385 @@
+"""Throughput and memory benchmarks of record conversion and full syncs.
+
+The benchmarks take minutes and the largest sync several GiB of memory, so
+they are marked "benchmark" and left out of the default run. Run them with
+``pytest -m benchmark``. They need pytest-benchmark and are skipped without it.
+
+The conversion benchmarks record their records per second and peak traced
+memory in the benchmark's extra_info and fail when they are more than
+BENCHMARK_TOLERANCE (default 0.3) slower, or use that much more memory, than
+the baseline stored in benchmark_baseline.json. Throughput is stored relative
+to the speed of a fixed reference workload measured in the same run, so the
+baseline holds across machines. After an intended change, refresh it with::
+
+    BENCHMARK_UPDATE_BASELINE=1 pytest -m benchmark tap_braintree/tests
+
+The sync benchmarks run the tap end to end against FakeBraintree, each in its
+own process with the messages written to /dev/null, for SYNC_SIZES
+transactions (BENCHMARK_SYNC_SIZES, comma separated, overrides them). Larger
+syncs are compared with the smallest one of the same run: their throughput
+and peak memory must stay within the tolerance of it, plus the bounded caches
+for memory.
+"""
+
+import copy
+import functools
+import json
+import os
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import braintree
+import pytest
+
+from tap_braintree.tap import TapBraintree
+from tap_braintree.tests.fake_braintree import (
+    FakeBraintree,
+    generate_customer,
+    generate_records,
+    generate_subscription,
+    generate_transaction,
+)
+from tap_braintree.tests.test_client import SAMPLE_CONFIG
+from tap_braintree.tests.test_tap import discover
+
+pytest.importorskip("pytest_benchmark")
+
+pytestmark = pytest.mark.benchmark
+
+BASELINE = Path(__file__).with_name("benchmark_baseline.json")
+TOLERANCE = float(os.environ.get("BENCHMARK_TOLERANCE", "0.3"))
+UPDATE_BASELINE = os.environ.get("BENCHMARK_UPDATE_BASELINE") == "1"
+# Allowance on top of the memory tolerance, so that streams converting with
+# a few KiB at a time don't fail on small allocator differences.
+MEMORY_SLACK_BYTES = 64 * 1024
+
+RECORDS = 1000
+CUSTOMERS = 200
+# Offset from midnight so no record sits on a window boundary.
+START = datetime(2021, 1, 1, 0, 0, 7)
+
+SYNC_SIZES = [
+    int(size)
+    for size in os.environ.get("BENCHMARK_SYNC_SIZES", "10000,50000,500000").split(",")
+]
+# Throughput and peak memory of the smallest sync of the run, by size.
+sync_results: dict = {}
+# Allowance on top of the memory tolerance of larger syncs, which fill the
+# serializers' caches of formatted timestamps up to MAX_FORMATTED_TIMESTAMPS
+# and the customer cache up to its size. Memory growing with the number of
+# records still exceeds it.
+SYNC_MEMORY_SLACK_BYTES = 64 * 1024 * 1024
+
+# The tap's CLI, writing its peak memory to PEAK_RSS_PATH when it exits.
+SYNC = """
+import atexit, os
+from pathlib import Path
+from tap_braintree.metrics import peak_rss
+from tap_braintree.tap import TapBraintree
+
+peak_path = Path(os.environ["PEAK_RSS_PATH"])
+atexit.register(lambda: peak_path.write_text(str(peak_rss())))
+TapBraintree.cli()
+"""
+
+
+def make_transactions(count=RECORDS):
+    """Transactions with status history, add-ons, discounts and, for one in a
+    hundred, a dispute."""
+    return [
+        braintree.Transaction(
+            None, generate_transaction(i, START + timedelta(minutes=i), CUSTOMERS)
+        )
+        for i in range(count)
+    ]
+
+
+def make_subscriptions(count=RECORDS):
+    return [
+        braintree.Subscription(
+            None, generate_subscription(i, START + timedelta(minutes=i))
+        )
+        for i in range(count)
+    ]
+
+
+def make_customers(count=RECORDS):
+    customers = []
+    for i in range(count):
+        attributes = generate_customer(i, START + timedelta(minutes=i))
+        attributes["addresses"].insert(
+            0, {"id": f"b{i}", "country_code_alpha2": None, "region": None}
+        )
+        customers.append(braintree.Customer(None, attributes))
+    return customers
+
+
+def get_tap(**config):
+    return TapBraintree(config={**SAMPLE_CONFIG, **config}, parse_env_config=False)
+
+
+def peak_memory(function) -> int:
+    """Return the peak memory traced while running function once."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def consume(records):
+    deque(records, maxlen=0)
+
+
+@functools.lru_cache(maxsize=None)
+def reference_speed() -> float:
+    """Return the operations per second of a fixed workload, copying a
+    generated transaction, on this machine."""
+    transaction = generate_transaction(0, START, CUSTOMERS)
+    seconds = min(
+        timeit.repeat(lambda: copy.deepcopy(transaction), number=200, repeat=5)
+    )
+    return 200 / seconds
+
+
+def relative(value: float) -> float:
+    """Return value per second relative to the reference_speed."""
+    return float(f"{value / reference_speed():.4g}")
+
+
+def get_baseline(benchmark, name, result):
+    """Record result in the benchmark and return the stored baseline of name,
+    or None after updating it."""
+    benchmark.extra_info.update(result)
+    baselines = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    if UPDATE_BASELINE:
+        baselines[name] = result
+        BASELINE.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        return None
+
+    baseline = baselines.get(name)
+    if baseline is None:
+        pytest.skip(f"No baseline for {name}, set BENCHMARK_UPDATE_BASELINE=1")
+    return baseline
+
+
+def check_baseline(benchmark, name, records, run):
+    """Record throughput and memory of the benchmark and compare them with the
+    stored baseline."""
+    if benchmark.stats is None:
+        # Benchmarks are disabled, the function only ran once.
+        return
+
+    records_per_second = records / benchmark.stats.stats.min
+    result = {
+        "records_per_second": round(records_per_second),
+        "relative_throughput": relative(records_per_second),
+        "peak_memory_bytes": peak_memory(run),
+    }
+    baseline = get_baseline(benchmark, name, result)
+    if baseline is None:
+        return
+    assert result["relative_throughput"] >= baseline["relative_throughput"] * (
+        1 - TOLERANCE
+    ), f"{name} throughput regressed: {result} vs baseline {baseline}"
+    assert (
+        result["peak_memory_bytes"]
+        <= baseline["peak_memory_bytes"] * (1 + TOLERANCE) + MEMORY_SLACK_BYTES
+    ), f"{name} peak memory regressed: {result} vs baseline {baseline}"
+
+
+def test_object_to_dict(benchmark):
+    stream = get_tap().streams["transactions"]
+    transactions = make_transactions()
+
+    def run():
+        for transaction in transactions:
+            stream.object_to_dict(transaction, {"transactions"})
+
+    benchmark.pedantic(run, rounds=5, warmup_rounds=1)
+    check_baseline(benchmark, "object_to_dict", len(transactions), run)
+
+
+@pytest.mark.parametrize(
+    "name,make_records",
+    [("subscriptions", make_subscriptions), ("customers", make_customers)],
+)
+def test_parse_record(benchmark, name, make_records):
+    stream = get_tap().streams[name]
+    records = make_records()
+
+    def run():
+        consume(stream.parse_record(record) for record in records)
+
+    benchmark.pedantic(run, rounds=5, warmup_rounds=1)
+    check_baseline(benchmark, f"parse_record[{name}]", len(records), run)
+
+
+def test_transactions_parse_record(benchmark):
+    stream = get_tap().streams["transactions"]
+    transactions = make_transactions()
+    # Billing backfills are answered from the customer cache, as they are once
+    # a sync has warmed it up.
+    for i in range(CUSTOMERS):
+        stream.customer_cache.set(f"cus{i}", ("GB", "London"))
+
+    def run():
+        consume(stream.parse_record(transaction) for transaction in transactions)
+
+    benchmark.pedantic(run, rounds=5, warmup_rounds=1)
+    check_baseline(benchmark, "parse_record[transactions]", len(transactions), run)
+
+
+@pytest.mark.parametrize("fast_output", [False, True], ids=["sdk", "fast"])
+def test_write_record_message(benchmark, monkeypatch, fast_output):
+    """RECORD messages of parsed transactions written to /dev/null, through the
+    SDK's writer or the fast_output one."""
+    stream = get_tap(fast_output=fast_output).streams["transactions"]
+    for i in range(CUSTOMERS):
+        stream.customer_cache.set(f"cus{i}", ("GB", "London"))
+    records = [stream.parse_record(record) for record in make_transactions()]
+    devnull = open(os.devnull, "w")
+    monkeypatch.setattr("sys.stdout", devnull)
+
+    def run():
+        for record in records:
+            stream._write_record_message(dict(record))
+        stream._tap.flush_messages()
+
+    try:
+        benchmark.pedantic(run, rounds=5, warmup_rounds=1)
+        name = "fast" if fast_output else "sdk"
+        check_baseline(benchmark, f"write_record_message[{name}]", len(records), run)
+    finally:
+        devnull.close()
+
+
+@pytest.fixture(scope="module")
+def fake_braintree():
+    counts = {"transactions": 500, "customers": CUSTOMERS}
+    records = generate_records(counts, START, START + timedelta(days=4))
+    server = FakeBraintree(records).start()
+    yield server
+    server.stop()
+
+
+def test_get_records(benchmark, fake_braintree):
+    """Full transaction sync against the local stand-in. Peak memory includes
+    the server threads answering the requests."""
+    tap = get_tap(api_url=fake_braintree.url, fetch_records_interval_hours=24 * 31)
+    stream = tap.streams["transactions"]
+
+    def run():
+        consume(stream.get_records(None))
+
+    benchmark.pedantic(run, rounds=3, warmup_rounds=1)
+    check_baseline(benchmark, "get_records[transactions]", 500, run)
+
+
+def test_discover_startup(benchmark):
+    """Interpreter startup, importing the tap and building its catalog, as
+    --discover does, in a fresh process."""
+    benchmark.pedantic(discover, rounds=5, warmup_rounds=1)
+    if benchmark.stats is None:
+        return
+
+    seconds = benchmark.stats.stats.min
+    # The startup time in operations of the reference workload.
+    result = {
+        "seconds": round(seconds, 3),
+        "reference_operations": round(seconds * reference_speed()),
+    }
+    baseline = get_baseline(benchmark, "discover", result)
+    if baseline is None:
+        return
+    assert result["reference_operations"] <= baseline["reference_operations"] * (
+        1 + TOLERANCE
+    ), f"discover startup regressed: {result} vs baseline {baseline}"
+
+
+def start_fake_braintree(transactions: int):
+    """Serve transactions, and a tenth as many subscriptions and customers,
+    from FakeBraintree in its own process. Return the process and its URL."""
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "tap_braintree.tests.fake_braintree",
+            "--port",
+            "0",
+            f"--transactions={transactions}",
+            f"--subscriptions={transactions // 10}",
+            f"--customers={transactions // 10}",
+            "--start=2021-01-01",
+            "--end=2021-02-01",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    return server, server.stdout.readline().split()[-1]
+
+
+def run_tap(config_path: Path) -> int:
+    """Sync every stream with the tap's CLI in a new process, writing its
+    messages to /dev/null, and return the process's peak memory in bytes.
+
+    The peak is read by the process itself. The rusage of a child would
+    include the memory of the test process it was forked from.
+    """
+    peak_path = config_path.with_name("peak_rss")
+    subprocess.run(
+        [sys.executable, "-c", SYNC, "--config", str(config_path)],
+        env={**os.environ, "PEAK_RSS_PATH": str(peak_path)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    return int(peak_path.read_text())
+
+
+@pytest.mark.parametrize("size", SYNC_SIZES)
+def test_sync(benchmark, tmp_path, size):
+    """Full sync of every stream, from the CLI to messages on /dev/null,
+    against FakeBraintree serving size transactions."""
+    records = size + 2 * (size // 10) + 2
+    server, url = start_fake_braintree(size)
+    try:
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps({**SAMPLE_CONFIG, "api_url": url}))
+        peak_rss = []
+        started = time.perf_counter()
+        benchmark.pedantic(
+            lambda: peak_rss.append(run_tap(config_path)), rounds=1, iterations=1
+        )
+        seconds = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    result = {
+        "records": records,
+        "records_per_second": round(records / seconds),
+        "peak_rss_bytes": peak_rss[0],
+    }
+    benchmark.extra_info.update(result)
+    smallest = min(SYNC_SIZES)
+    if size == smallest:
+        sync_results[size] = result
+        return
+    baseline = sync_results.get(smallest)
+    if baseline is None:
+        pytest.skip(f"The sync of {smallest} transactions didn't run")
+    assert result["records_per_second"] >= baseline["records_per_second"] * (
+        1 - TOLERANCE
+    ), f"sync of {size} is slower than of {smallest}: {result} vs {baseline}"
+    assert (
+        result["peak_rss_bytes"]
+        <= baseline["peak_rss_bytes"] * (1 + TOLERANCE) + SYNC_MEMORY_SLACK_BYTES
+    ), f"sync of {size} uses more memory than of {smallest}: {result} vs {baseline}"
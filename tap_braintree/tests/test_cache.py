@@ -0,0 +1,33 @@
+"""Tests for the customer address cache."""
+
+from tap_braintree.cache import CustomerAddressCache
+
+
+def test_lru_eviction_and_negative_entries():
+    cache = CustomerAddressCache(max_size=2)
+    cache.set("a", ("US", "CA"))
+    cache.set("b", None)
+    assert cache.get("a") == ("US", "CA")
+    cache.set("c", ("GB", None))
+
+    assert cache.get("b") is CustomerAddressCache.MISSING
+    assert cache.get("a") == ("US", "CA")
+    assert cache.get("c") == ("GB", None)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_persisted_entries_expire(tmp_path):
+    path = tmp_path / "customers.db"
+    cache = CustomerAddressCache(path=path)
+    cache.set("a", ("US", "CA"))
+    cache.set("b", None)
+    cache.close()
+
+    cache = CustomerAddressCache(path=path)
+    assert cache.get("a") == ("US", "CA")
+    assert cache.get("b") is None
+    cache.close()
+
+    cache = CustomerAddressCache(path=path, ttl_hours=0)
+    assert cache.get("a") is CustomerAddressCache.MISSING
+    cache.close()
@@ -0,0 +1,580 @@
+"""Tests for the window fetching logic of BraintreeStream."""
+
+import datetime
+import threading
+import time
+
+import pytest
+import pytz
+from braintree.attribute_getter import AttributeGetter
+from singer_sdk.helpers._typing import conform_record_data_types
+
+from tap_braintree.client import BraintreeStream, ResultLimitExceededError
+from tap_braintree.metrics import STAGES, percentile
+from tap_braintree.tap import TapBraintree
+
+SAMPLE_CONFIG = {
+    "merchant_id": "merchant",
+    "public_key": "public",
+    "private_key": "private",
+    "start_date": "2021-01-01T00:00:00Z",
+    "sync_state": "full",
+    "global_stream_state": "2020-01-01",
+}
+
+
+class FakeResults(list):
+    """Stand-in for braintree.ResourceCollection."""
+
+    @property
+    def maximum_size(self):
+        return len(self)
+
+
+class FakeSearch:
+    """Stand-in for a Braintree search node and resource class."""
+
+    def __init__(self, records_per_window=2, records_per_hour=None):
+        self.records_per_window = records_per_window
+        self.records_per_hour = records_per_hour
+        self.searches = []
+
+    def between(self, start, end):
+        return start, end
+
+    def search(self, window):
+        start, end = window
+        self.searches.append(window)
+        count = self.records_per_window
+        if self.records_per_hour is not None:
+            count = int((end - start).total_seconds() / 3600 * self.records_per_hour)
+        return FakeResults(
+            AttributeGetter(
+                {
+                    "id": f"{start:%Y%m%d%H}-{i}",
+                    "created_at": start.replace(tzinfo=None),
+                    "updated_at": start.replace(tzinfo=None),
+                }
+            )
+            for i in range(count)
+        )
+
+
+def get_stream(name="customers", search=None, **config):
+    search = search or {}
+    tap = TapBraintree(config={**SAMPLE_CONFIG, **config}, parse_env_config=False)
+    stream = tap.streams[name]
+    fake = FakeSearch(**search)
+    stream.braintree_obj = fake
+    stream.braintree_search = fake
+    stream.set_braintree_config = lambda: None
+    return stream, fake
+
+
+def test_date_range_covers_period():
+    start = datetime.datetime(2021, 1, 1, tzinfo=pytz.UTC)
+    end = datetime.datetime(2021, 1, 3, 12, tzinfo=pytz.UTC)
+    windows = list(BraintreeStream.date_range(start, end, 24))
+    assert windows[0][0] == start
+    assert windows[-1][1] == end
+    assert all(a[1] == b[0] for a, b in zip(windows, windows[1:]))
+
+
+def test_parallel_windows_preserve_order():
+    sequential, _ = get_stream()
+    parallel, fake = get_stream(max_parallel_windows=4)
+    start = datetime.datetime(2021, 1, 1, tzinfo=pytz.UTC)
+    end = datetime.datetime(2021, 1, 11, tzinfo=pytz.UTC)
+
+    def ids(stream):
+        windows = stream.date_range(start, end, 24)
+        return [
+            record.id
+            for _, _, records, _ in stream.fetch_windows(windows)
+            for record in records
+        ]
+
+    assert ids(parallel) == ids(sequential)
+    assert len(fake.searches) == 10
+
+
+def test_bounded_parallel_windows_buffer_few_records():
+    sequential, _ = get_stream(search={"records_per_window": 30})
+    bounded, _ = get_stream(
+        search={"records_per_window": 30},
+        max_parallel_windows=3,
+        max_buffered_records=4,
+    )
+    start = datetime.datetime(2021, 1, 1, tzinfo=pytz.UTC)
+    end = datetime.datetime(2021, 1, 11, tzinfo=pytz.UTC)
+
+    def ids(stream):
+        windows = stream.date_range(start, end, 24)
+        return [
+            record.id
+            for _, _, records, _ in stream.fetch_windows(windows)
+            for record in records
+        ]
+
+    assert ids(bounded) == ids(sequential)
+
+    fetched = []
+
+    def fetch_window(start, end, metrics=None):
+        for i in range(30):
+            fetched.append(i)
+            yield AttributeGetter({"id": f"{start:%d}-{i}"})
+
+    bounded.fetch_window = fetch_window
+    windows = bounded.fetch_windows(bounded.date_range(start, end, 24))
+    _, _, records, _ = next(windows)
+    next(records)
+    time.sleep(0.2)
+    # Three windows in flight, each with a full buffer and one record waiting
+    # to be put.
+    assert len(fetched) <= 3 * (4 + 1) + 1
+    windows.close()
+    assert not any(
+        thread.name.startswith("customers-window") for thread in threading.enumerate()
+    )
+
+
+def test_adaptive_windows_split_and_grow():
+    stream, fake = get_stream(
+        search={"records_per_hour": 1},
+        adaptive_windows=True,
+        fetch_records_interval_hours=96,
+    )
+    stream.api_result_limit = 40
+    start = datetime.datetime(2021, 1, 1, tzinfo=pytz.UTC)
+    end = datetime.datetime(2021, 1, 11, tzinfo=pytz.UTC)
+
+    records = [
+        record
+        for _, _, window, _ in stream.fetch_windows(stream.window_range(start, end))
+        for record in window
+    ]
+
+    assert len(records) == 240
+    assert len({record.id for record in records}) == 240
+    spans = [(b - a) / datetime.timedelta(hours=1) for a, b in fake.searches]
+    # 96h is over the limit and gets bisected twice, 24h is more than half full.
+    assert spans[:7] == [96, 48, 24, 24, 48, 24, 24]
+    assert spans[7] == 12
+
+
+class FakeIdSearch:
+    """Stand-in for a search field that matches records by id."""
+
+    def __init__(self, ids_by_day):
+        self.ids_by_day = ids_by_day
+
+    def between(self, start, end):
+        return [id for id in self.ids_by_day.get(start.day, [])]
+
+    def in_list(self, ids):
+        return ids
+
+
+def test_incremental_sync_searches_changed_records():
+    stream, _ = get_stream("transactions")
+    searched = []
+
+    class FakeTransaction:
+        @staticmethod
+        def search(ids):
+            searched.append(ids)
+            results = FakeResults(AttributeGetter({"id": id}) for id in ids)
+            results.ids = list(ids)
+            return results
+
+    stream.braintree_obj = FakeTransaction
+    stream.braintree_id_search = FakeIdSearch({})
+    stream.incremental_search_fields = (
+        FakeIdSearch({1: ["a", "b"], 2: ["c"]}),
+        FakeIdSearch({1: ["b"], 2: ["a", "d"]}),
+    )
+    stream.incremental_sync = True
+    stream.synced_ids = set()
+    stream.synced_ids_lock = threading.Lock()
+    day = datetime.timedelta(days=1)
+    start = datetime.datetime(2021, 1, 1, tzinfo=pytz.UTC)
+
+    ids = [
+        record.id
+        for _, _, records, _ in stream.fetch_windows(
+            stream.date_range(start, start + 2 * day, 24)
+        )
+        for record in records
+    ]
+
+    # Records changed in several fields or windows are only fetched once.
+    assert ids == ["a", "b", "c", "d"]
+    assert ["a", "b"] in searched and ["c", "d"] in searched
+
+
+def test_incremental_sync_uses_updated_at_bookmark():
+    stream, _ = get_stream("transactions")
+    assert stream.get_updated_at_bookmark(None) is None
+
+    stream.get_context_state(None).update(
+        replication_key="updated_at",
+        replication_key_value="2021-02-03T04:05:06+00:00",
+    )
+    assert stream.get_updated_at_bookmark(None) == datetime.datetime(
+        2021, 2, 3, 4, 5, 6, tzinfo=datetime.timezone.utc
+    )
+    assert "updated_at" in stream.selected_properties
+
+
+def test_sync_resumes_after_last_completed_window():
+    stream, fake = get_stream(fetch_records_interval_hours=24)
+    checkpoints = []
+    stream._write_state_message = lambda: checkpoints.append(
+        dict(stream.get_context_state(None))
+    )
+    end = datetime.datetime.utcnow().replace(tzinfo=pytz.UTC)
+    resume = end - datetime.timedelta(days=2, hours=12)
+    stream.get_context_state(None)["last_window_end"] = resume.isoformat()
+
+    records = list(stream.get_records(None))
+
+    assert fake.searches[0][0] == resume
+    assert len(fake.searches) == 3 and len(records) == 6
+    assert [state["last_window_end"] for state in checkpoints] == [
+        b.isoformat() for _, b in fake.searches
+    ]
+    assert "last_window_end" not in stream.get_context_state(None)
+
+
+def test_empty_windows_are_checkpointed_once_per_interval():
+    stream, fake = get_stream(
+        fetch_records_interval_hours=24, search={"records_per_window": 0}
+    )
+    checkpoints = []
+    stream._write_state_message = lambda: checkpoints.append(
+        dict(stream.get_context_state(None))
+    )
+    end = datetime.datetime.utcnow().replace(tzinfo=pytz.UTC)
+    resume = (end - datetime.timedelta(days=4, hours=12)).isoformat()
+    stream.get_context_state(None)["last_window_end"] = resume
+
+    assert list(stream.get_records(None)) == []
+    assert len(fake.searches) == 5 and checkpoints == []
+
+    # A failing window keeps the checkpoint of the empty windows before it.
+    search = fake.search
+    fake.searches = []
+    fake.search = lambda window: (
+        search(window) if len(fake.searches) < 3 else 1 / 0
+    )
+    stream.get_context_state(None)["last_window_end"] = resume
+    with pytest.raises(ZeroDivisionError):
+        list(stream.get_records(None))
+    assert [state["last_window_end"] for state in checkpoints] == [
+        fake.searches[2][1].isoformat()
+    ]
+
+    stream, _ = get_stream(
+        fetch_records_interval_hours=24,
+        checkpoint_interval_seconds=0,
+        search={"records_per_window": 0},
+    )
+    stream._write_state_message = lambda: checkpoints.append(None)
+    stream.get_context_state(None)["last_window_end"] = resume
+    checkpoints.clear()
+    list(stream.get_records(None))
+    assert len(checkpoints) == 5
+
+
+class FakeCollection(FakeResults):
+    """Stand-in for a ResourceCollection that fetches its pages on demand."""
+
+    def __init__(self, ids, page_size):
+        super().__init__(AttributeGetter({"id": id}) for id in ids)
+        self.ids = ids
+        self._ResourceCollection__page_size = page_size
+        self._ResourceCollection__query = "query"
+        self.pages = []
+
+    def _ResourceCollection__method(self, query, ids):
+        self.pages.append(ids)
+        return [AttributeGetter({"id": id}) for id in ids]
+
+
+def test_id_first_fetch_prefetches_pages_and_skips_emitted_ids():
+    stream, _ = get_stream(id_first_fetch=True, prefetch_pages=2)
+    stream.synced_ids = {"b"}
+    stream.synced_ids_lock = threading.Lock()
+    records = FakeCollection(["a", "b", "c", "d", "a", "e", "f"], page_size=2)
+
+    ids = [record.id for record in stream.fetch_pages(records)]
+
+    assert ids == ["a", "c", "d", "e", "f"]
+    assert sorted(records.pages) == [["a", "c"], ["d", "e"], ["f"]]
+    assert stream.synced_ids == {"a", "b", "c", "d", "e", "f"}
+
+
+def test_id_first_fetch_releases_unfetched_ids_on_failure():
+    stream, _ = get_stream(id_first_fetch=True)
+    stream.synced_ids = set()
+    stream.synced_ids_lock = threading.Lock()
+    records = FakeCollection(["a", "b", "c"], page_size=1)
+
+    def fetch_page(records, ids):
+        if ids == ["b"]:
+            raise ConnectionError()
+        return [AttributeGetter({"id": id}) for id in ids]
+
+    stream.fetch_page = fetch_page
+    fetched = []
+    try:
+        for record in stream.fetch_pages(records):
+            fetched.append(record.id)
+    except ConnectionError:
+        pass
+
+    assert fetched == ["a"]
+    assert stream.synced_ids == {"a"}
+
+
+def test_get_records_emits_stage_timings_per_window():
+    stream, fake = get_stream(fetch_records_interval_hours=24)
+    stream._write_state_message = lambda: None
+    metrics = []
+    stream._write_metric_log = lambda metric, extra_tags: metrics.append(metric)
+    end = datetime.datetime.utcnow().replace(tzinfo=pytz.UTC)
+    resume = end - datetime.timedelta(days=2, hours=12)
+    stream.get_context_state(None)["last_window_end"] = resume.isoformat()
+
+    records = list(stream.get_records(None))
+
+    durations = [m for m in metrics if m["metric"] == "window_stage_duration"]
+    assert len(durations) == 3 * len(STAGES)
+    assert {m["tags"]["stage"] for m in durations} == set(STAGES)
+    assert all(m["value"] >= 0 for m in durations)
+    peaks = [m for m in metrics if m["metric"] == "window_peak_memory_bytes"]
+    assert len(peaks) == 3 and all(m["value"] > 0 for m in peaks)
+    counts = [m for m in metrics if m["metric"] == "window_record_count"]
+    assert [m["value"] for m in counts] == [2, 2, 2]
+    assert [m["tags"]["window_start"] for m in counts] == [
+        str(start) for start, _ in fake.searches
+    ]
+    summary = [
+        m for m in metrics if m["metric"] == "window_stage_duration_percentile"
+    ]
+    assert {(m["tags"]["stage"], m["tags"]["percentile"]) for m in summary} == {
+        (stage, p) for stage in STAGES for p in ("p50", "p95", "p99")
+    }
+    assert len(records) == 6
+
+
+def test_percentile_interpolates_between_ranks():
+    assert percentile([], 50) == 0.0
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([4.0, 1.0, 3.0, 2.0], 50) == 2.5
+    assert percentile(list(range(101)), 95) == 95
+
+
+def test_partitions_are_aligned_months_up_to_now():
+    stream, _ = get_stream(
+        "transactions", partition_months=3, start_date="2021-02-15T00:00:00Z"
+    )
+    partitions = stream.partitions
+
+    assert partitions[:2] == [
+        {
+            "partition_start": "2021-01-01T00:00:00+00:00",
+            "partition_end": "2021-04-01T00:00:00+00:00",
+        },
+        {
+            "partition_start": "2021-04-01T00:00:00+00:00",
+            "partition_end": "2021-07-01T00:00:00+00:00",
+        },
+    ]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    last = stream.get_partition_range(partitions[-1])
+    assert last[0] <= now < last[1]
+    assert stream.partitions == partitions
+    assert get_stream("plans", partition_months=3)[0].partitions is None
+
+
+def test_partition_syncs_its_range_and_skips_once_complete():
+    stream, fake = get_stream(
+        "subscriptions", partition_months=1, fetch_records_interval_hours=24 * 31
+    )
+    stream._write_state_message = lambda: None
+    stream.get_context_state(None).update(
+        replication_key="updated_at",
+        replication_key_value="2021-02-03T04:05:06+00:00",
+    )
+    old, recent = stream.partitions[1], stream.partitions[-1]
+
+    assert len(list(stream.get_records(old))) == 2
+    assert fake.searches == [stream.get_partition_range(old)]
+    assert stream.get_context_state(old)["synced_until"] == old["partition_end"]
+
+    assert list(stream.get_records(old)) == []
+    assert len(fake.searches) == 1
+
+    # The current partition is synced again on every run.
+    list(stream.get_records(recent))
+    list(stream.get_records(recent))
+    assert len(fake.searches) == 3
+    assert fake.searches[1][0] == stream.get_partition_range(recent)[0]
+
+
+def test_unchanged_records_are_not_emitted_again(tmp_path):
+    def sync(**config):
+        stream, _ = get_stream(
+            record_fingerprint_dir=str(tmp_path),
+            fetch_records_interval_hours=24 * 31,
+            **config,
+        )
+        stream._write_state_message = lambda: None
+        return list(stream.get_records(None))
+
+    first = sync()
+    assert first and sync() == []
+    assert sync(force_full_emit=True) == first
+    assert (tmp_path / "customers.sqlite").exists()
+
+
+def test_conform_record_matches_sdk():
+    stream, _ = get_stream("transactions")
+    record = {
+        "id": "a",
+        "amount": 1.5,
+        "created_at": datetime.datetime(2021, 1, 2, 3, 4, 5),
+        "credit_card_venmo_sdk": 0,
+        "disbursement_details_funds_held": None,
+        "disbursement_details_success": "yes",
+        "unknown": "dropped",
+    }
+    expected = conform_record_data_types(
+        stream.name, record, stream.schema, stream.logger
+    )
+    assert stream.conform_record(record) == expected
+    assert expected["credit_card_venmo_sdk"] is False
+
+
+def test_subscription_updated_after_bookmark_is_synced_again():
+    stream, fake = get_stream("subscriptions", fetch_records_interval_hours=24 * 31)
+    stream._write_state_message = lambda: None
+    stream.get_context_state(None).update(
+        replication_key="updated_at",
+        replication_key_value="2021-06-01T00:00:00+00:00",
+    )
+    created = datetime.datetime(2021, 1, 2)
+    canceled = AttributeGetter(
+        {
+            "id": "sub1",
+            "status": "Canceled",
+            "created_at": created,
+            "updated_at": datetime.datetime(2021, 7, 1),
+        }
+    )
+
+    def search(window):
+        fake.searches.append(window)
+        start, end = window
+        inside = start.replace(tzinfo=None) <= created < end.replace(tzinfo=None)
+        return FakeResults([canceled] if inside else [])
+
+    fake.search = search
+    records = list(stream.get_records(None))
+
+    assert fake.searches[0][0] == datetime.datetime(2021, 1, 1, tzinfo=pytz.UTC)
+    assert [(record["id"], record["status"]) for record in records] == [
+        ("sub1", "Canceled")
+    ]
+
+
+def test_buffered_records_are_bounded_in_every_mode():
+    assert get_stream()[0].max_buffered_records is None
+    assert get_stream(max_parallel_windows=2)[0].max_buffered_records == 1000
+
+    stream, _ = get_stream(
+        id_first_fetch=True, prefetch_pages=4, max_buffered_records=4
+    )
+    stream.synced_ids = set()
+    stream.synced_ids_lock = threading.Lock()
+    records = FakeCollection([str(i) for i in range(20)], page_size=2)
+
+    pages = stream.fetch_pages(records)
+    assert next(pages).id == "0"
+    time.sleep(0.1)
+    # The page consumed and one page fetched ahead.
+    assert len(records.pages) == 2
+    assert [record.id for record in pages] == [str(i) for i in range(1, 20)]
+
+
+def test_peak_memory_is_only_measured_for_serial_syncs():
+    for config in ({"max_parallel_windows": 2}, {"parallel_streams": True}):
+        stream, _ = get_stream(fetch_records_interval_hours=24, **config)
+        stream._write_state_message = lambda: None
+        metrics = []
+        stream._write_metric_log = lambda metric, extra_tags: metrics.append(metric)
+        end = datetime.datetime.utcnow().replace(tzinfo=pytz.UTC)
+        resume = end - datetime.timedelta(days=1, hours=12)
+        stream.get_context_state(None)["last_window_end"] = resume.isoformat()
+
+        assert len(list(stream.get_records(None))) == 4
+        assert "window_peak_memory_bytes" not in {m["metric"] for m in metrics}
+
+
+def test_windows_over_the_api_limit_are_split_or_fail():
+    stream, fake = get_stream(
+        search={"records_per_hour": 10}, fetch_records_interval_hours=8
+    )
+    stream.api_result_limit = 40
+    stream.window_hours = 8
+    start = datetime.datetime(2021, 1, 1, tzinfo=pytz.UTC)
+
+    records = list(stream.fetch_window(start, start + datetime.timedelta(hours=8)))
+
+    assert len(records) == 80
+    spans = [(b - a) / datetime.timedelta(hours=1) for a, b in fake.searches]
+    assert spans == [8, 4, 2, 2, 4, 2, 2]
+    # Upcoming windows keep their size without adaptive_windows.
+    assert stream.window_hours == 8
+
+    stream.api_result_limit = 10
+    with pytest.raises(ResultLimitExceededError):
+        list(stream.fetch_window(start, start + datetime.timedelta(hours=1)))
+
+
+def test_retried_changed_records_window_loses_no_records():
+    stream, _ = get_stream("transactions", max_window_retries=1)
+    failures = []
+
+    class FailingResults(FakeResults):
+        """Fails once while fetching the page with record b."""
+
+        def __iter__(self):
+            for record in super().__iter__():
+                if record.id == "b" and not failures:
+                    failures.append(record.id)
+                    raise ConnectionError()
+                yield record
+
+    class FakeTransaction:
+        @staticmethod
+        def search(ids):
+            results = FailingResults(AttributeGetter({"id": id}) for id in ids)
+            results.ids = list(ids)
+            return results
+
+    stream.braintree_obj = FakeTransaction
+    stream.braintree_id_search = FakeIdSearch({})
+    stream.incremental_search_fields = (FakeIdSearch({1: ["a", "b", "c"]}),)
+    stream.incremental_sync = True
+    stream.synced_ids = set()
+    stream.synced_ids_lock = threading.Lock()
+    stream.request_scheduler.wait = lambda attempt: None
+    start = datetime.datetime(2021, 1, 1, tzinfo=pytz.UTC)
+
+    records = stream.fetch_window(start, start + datetime.timedelta(days=1))
+
+    assert [record.id for record in records] == ["a", "b", "c"]
+    assert failures == ["b"]
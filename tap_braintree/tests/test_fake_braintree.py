@@ -0,0 +1,80 @@
+"""End to end tests of the streams against the local Braintree stand-in."""
+
+import datetime
+
+import pytest
+
+from tap_braintree.tap import TapBraintree
+from tap_braintree.tests.fake_braintree import FakeBraintree, generate_records
+from tap_braintree.tests.test_client import SAMPLE_CONFIG
+
+COUNTS = {"transactions": 300, "subscriptions": 20, "customers": 50}
+
+
+@pytest.fixture(scope="module")
+def fake_braintree():
+    # Offset from midnight so no record sits on a window boundary, where the
+    # inclusive searches of both windows would return it.
+    start = datetime.datetime(2021, 1, 1, 0, 0, 7)
+    records = generate_records(COUNTS, start, start + datetime.timedelta(days=4))
+    server = FakeBraintree(records, page_size=20).start()
+    yield server
+    server.stop()
+
+
+def get_tap(fake_braintree, **config):
+    return TapBraintree(
+        config={
+            **SAMPLE_CONFIG,
+            "api_url": fake_braintree.url,
+            "fetch_records_interval_hours": 24 * 31,
+            **config,
+        },
+        parse_env_config=False,
+    )
+
+
+def test_streams_sync_from_fake_braintree(fake_braintree):
+    tap = get_tap(fake_braintree)
+    for name, count in COUNTS.items():
+        records = list(tap.streams[name].get_records(None))
+        assert len(records) == count
+        assert len({record["id"] for record in records}) == count
+
+    plans = list(tap.streams["plans"].get_records(None))
+    assert [plan["id"] for plan in plans] == ["monthly", "yearly"]
+    # Plans, add-ons and discounts are loaded once for all streams.
+    assert fake_braintree.catalog_requests == 3
+    assert set(tap.catalog_index.add_ons) == {"SaaS_TAX"}
+
+
+def test_catalog_is_only_loaded_for_selected_references(fake_braintree):
+    catalog = get_tap(fake_braintree).catalog_dict
+    for entry in catalog["streams"]:
+        for metadata in entry["metadata"]:
+            if metadata["breadcrumb"][-1:] in (["add_ons"], ["discounts"]):
+                metadata["metadata"]["selected"] = False
+    config = dict(get_tap(fake_braintree).config)
+    tap = TapBraintree(config=config, catalog=catalog, parse_env_config=False)
+    requests = fake_braintree.catalog_requests
+
+    for name in ("transactions", "subscriptions"):
+        assert list(tap.streams[name].get_records(None))
+    assert fake_braintree.catalog_requests == requests
+
+    list(tap.streams["plans"].get_records(None))
+    assert fake_braintree.catalog_requests == requests + 3
+
+
+def test_transactions_match_across_fetch_modes(fake_braintree):
+    expected = list(get_tap(fake_braintree).streams["transactions"].get_records(None))
+    tap = get_tap(fake_braintree, id_first_fetch=True, max_parallel_windows=4)
+    records = list(tap.streams["transactions"].get_records(None))
+    tap = get_tap(fake_braintree, max_parallel_windows=4, max_buffered_records=7)
+    bounded = list(tap.streams["transactions"].get_records(None))
+
+    assert records == expected
+    assert bounded == expected
+    # Every tenth transaction gets its billing country from the customer.
+    assert records[0]["billing_country_code_alpha2"] == "GB"
+    assert records[1]["billing_country_code_alpha2"] == "US"
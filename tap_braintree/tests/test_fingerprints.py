@@ -0,0 +1,40 @@
+"""Tests for the record fingerprint index."""
+
+from tap_braintree.fingerprints import RecordFingerprintIndex
+
+
+def test_only_changed_records_after_commit(tmp_path):
+    path = tmp_path / "transactions.sqlite"
+    index = RecordFingerprintIndex(path)
+    assert index.changed("a", {"id": "a", "amount": 1})
+    index.commit()
+    assert index.changed("b", {"id": "b", "amount": 2})
+    index.close(commit=False)
+
+    index = RecordFingerprintIndex(path)
+    assert not index.changed("a", {"amount": 1, "id": "a"})
+    assert index.changed("a", {"id": "a", "amount": 3})
+    # b was not committed by the interrupted run.
+    assert index.changed("b", {"id": "b", "amount": 2})
+    assert index.unchanged == 1
+    index.close()
+
+    index = RecordFingerprintIndex(path, force=True)
+    assert index.changed("b", {"id": "b", "amount": 2})
+    index.close()
+
+
+def test_close_drops_entries_not_seen_within_ttl(tmp_path):
+    path = tmp_path / "customers.sqlite"
+    index = RecordFingerprintIndex(path)
+    for i in range(1000):
+        index.changed(str(i), {"id": str(i), "name": "x" * 100})
+    index.close()
+    size = path.stat().st_size
+
+    RecordFingerprintIndex(path, ttl_days=0).close()
+
+    index = RecordFingerprintIndex(path)
+    assert index.changed("1", {"id": "1", "name": "x" * 100})
+    index.close()
+    assert path.stat().st_size < size / 2
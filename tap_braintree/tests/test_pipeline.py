@@ -0,0 +1,45 @@
+"""Tests for converting records on the tap's process pool."""
+
+import braintree
+
+from tap_braintree.tests.test_client import get_stream
+from tap_braintree.tests.test_serializer import make_transaction
+
+
+def test_pipelined_conversion_matches_inline():
+    inline, _ = get_stream("transactions")
+    pipelined, _ = get_stream("transactions", pipeline_workers=2, pipeline_batch_size=3)
+    gateway = braintree.BraintreeGateway(
+        braintree.Configuration(
+            braintree.Environment.Sandbox, "merchant", "public", "private"
+        )
+    )
+    for stream in (inline, pipelined):
+        stream.prefetch_customer_addresses = lambda customer_ids: None
+        stream.find_customer_address = lambda customer_id: None
+    transactions = [make_transaction(i) for i in range(10)]
+    for transaction in transactions:
+        transaction.gateway = gateway
+
+    try:
+        actual = list(pipelined.parse_records(iter(transactions)))
+    finally:
+        pipelined._tap.close_process_pool()
+
+    assert actual == list(inline.parse_records(transactions))
+    assert [record["id"] for record in actual] == [f"tx{i}" for i in range(10)]
+    assert actual[0]["subscription_tax_amount"] == 1.25
+
+
+def test_streams_share_one_process_pool_that_does_not_fork():
+    transactions, _ = get_stream("transactions", pipeline_workers=1)
+    tap = transactions._tap
+    customers = tap.streams["customers"]
+
+    try:
+        pool = transactions.record_pipeline.executor
+        assert customers.record_pipeline.executor is pool
+        assert pool._mp_context.get_start_method() in ("forkserver", "spawn")
+    finally:
+        tap.close_process_pool()
+    assert tap._process_pool is None
@@ -0,0 +1,151 @@
+"""Tests for the request scheduler and the window retries built on it."""
+
+import datetime
+
+import braintree
+import pytest
+import pytz
+import requests
+
+from tap_braintree.http_session import PooledHttp
+from tap_braintree.scheduler import (
+    RequestScheduler,
+    RetriesExhaustedError,
+    ScheduledHttp,
+)
+from tap_braintree.tests.test_client import get_stream
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_limits_request_rate():
+    clock = FakeClock()
+    scheduler = RequestScheduler(requests_per_second=2, clock=clock, sleep=clock.sleep)
+
+    for _ in range(6):
+        scheduler.acquire()
+
+    # Two requests of burst, then one every half second.
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_backoff_grows_with_jitter_up_to_the_limit():
+    scheduler = RequestScheduler(backoff_seconds=1, max_backoff_seconds=8)
+    for attempt, delay in ((1, 1), (2, 2), (3, 4), (4, 8), (10, 8)):
+        assert delay / 2 <= scheduler.backoff(attempt) <= delay
+
+
+def test_scheduled_http_retries_throttled_requests(monkeypatch):
+    clock = FakeClock()
+    scheduler = RequestScheduler(
+        requests_per_second=10, max_retries=3, clock=clock, sleep=clock.sleep
+    )
+    responses = [
+        requests.exceptions.ReadTimeout(),
+        [429, ""],
+        [503, ""],
+        [200, "<ok/>"],
+    ]
+
+    def http_do(self, http_verb, path, headers, request_body):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(PooledHttp, "http_do", http_do)
+    config = braintree.Configuration(
+        braintree.Environment.Sandbox, "merchant", "public", "private"
+    )
+    http = ScheduledHttp(config, scheduler=scheduler)
+
+    assert http.http_do("POST", "/", {}, "") == [200, "<ok/>"]
+    assert scheduler.retries == 3 and scheduler.throttled == 1
+    assert scheduler.rate < 10
+
+
+def test_failed_window_is_retried_without_duplicates():
+    stream, fake = get_stream(max_window_retries=2)
+    stream.request_scheduler._sleep = lambda seconds: None
+    search = fake.search
+    failures = [True, False]
+
+    def flaky_search(window):
+        records = search(window)
+        if failures.pop(0):
+            yield records[0]
+            raise requests.exceptions.ConnectionError()
+        yield from records
+
+    stream.search_window = lambda start, end: FlakyResults(flaky_search((start, end)))
+    start = datetime.datetime(2021, 1, 1, tzinfo=pytz.UTC)
+    end = start + datetime.timedelta(days=1)
+
+    assert [record.id for record in stream.fetch_window(start, end)] == [
+        "2021010100-0",
+        "2021010100-1",
+    ]
+
+    failures[:] = [True, True, True]
+    with pytest.raises(RetriesExhaustedError):
+        list(stream.fetch_window(start, end))
+
+
+class FlakyResults:
+    def __init__(self, records):
+        self.records = records
+        self.maximum_size = 2
+
+    def __iter__(self):
+        return self.records
+
+
+def test_streams_share_one_gateway_and_session():
+    stream, _ = get_stream("transactions")
+    tap = stream._tap
+    sent = []
+
+    class Response:
+        status_code = 200
+
+        def __init__(self, collection, item):
+            self.text = (
+                f'<{collection} type="array"><{item}><id>monthly</id>'
+                f"<amount>9.99</amount></{item}></{collection}>"
+            )
+
+    def send(request, **kwargs):
+        sent.append(request.url)
+        collection = request.url.rstrip("/").rsplit("/", 1)[1].replace("_", "-")
+        return Response(collection, collection[:-1])
+
+    strategy = tap.gateway.config.http_strategy()
+    strategy.session.send = send
+
+    for name in ("plans", "subscriptions"):
+        tap.streams[name].set_braintree_config()
+    plans = tap.streams["plans"].braintree_obj.all()
+    plans += tap.streams["plans"].braintree_obj.all()
+
+    assert [plan.id for plan in plans] == ["monthly", "monthly"]
+    assert tap.streams["subscriptions"].braintree_obj.gateway is tap.gateway
+    # The subscriptions load the catalog once, the plans are requested twice.
+    merchant = "https://api.braintreegateway.com:443/merchants/merchant"
+    assert sent == [
+        f"{merchant}/plans/",
+        f"{merchant}/add_ons/",
+        f"{merchant}/discounts/",
+        f"{merchant}/plans/",
+        f"{merchant}/plans/",
+    ]
@@ -0,0 +1,282 @@
+"""Tests that the record serializer matches the original flatten based output."""
+
+import json
+import types
+from datetime import date, datetime
+from decimal import Decimal
+
+import braintree
+import pytz
+import singer
+from flatten_json import flatten
+
+from tap_braintree.catalog_index import CatalogIndex
+from tap_braintree.serializer import RecordSerializer
+from tap_braintree.tap import TapBraintree
+from tap_braintree.tests.test_client import SAMPLE_CONFIG, get_stream
+
+
+def legacy_object_to_dict(braintree_objects, d, ignore_obj):  # noqa: C901
+    """BraintreeStream.object_to_dict as it was before RecordSerializer."""
+    flat_attr = dict()
+    array_attr = dict()
+
+    try:
+        attributes = d._setattrs
+    except AttributeError:
+        return d
+
+    for attr in attributes:
+        if attr == "addresses" and hasattr(d, attr):
+            addresses = getattr(d, attr)
+            if addresses and len(addresses) > 0:
+                valid_address = next(
+                    (addr for addr in addresses
+                     if hasattr(addr, "country_code_alpha2")
+                     and getattr(addr, "country_code_alpha2") is not None),
+                    addresses[0]
+                )
+                for address_attr in valid_address._setattrs:
+                    if hasattr(valid_address, address_attr):
+                        flat_attr[f"address_{address_attr}"] = getattr(
+                            valid_address, address_attr
+                        )
+            continue
+        if hasattr(d, attr) and isinstance(
+            getattr(d, attr), (list, set, tuple, types.GeneratorType)
+        ):
+            child_obj_list = []
+            for obj in getattr(d, attr):
+                if isinstance(obj, dict):
+                    child_obj_list.append(
+                        flatten(
+                            legacy_object_to_dict(braintree_objects, obj, ignore_obj)
+                        )
+                    )
+                else:
+                    child_obj_list.append(
+                        legacy_object_to_dict(braintree_objects, obj, ignore_obj)
+                    )
+            if len(child_obj_list) > 0:
+                array_attr[attr] = child_obj_list
+        elif hasattr(d, attr) and isinstance(getattr(d, attr), Decimal):
+            flat_attr[attr] = float(getattr(d, attr))
+        elif hasattr(d, attr) and isinstance(getattr(d, attr), datetime):
+            flat_attr[attr] = str(getattr(d, attr).replace(tzinfo=pytz.UTC))
+        elif hasattr(d, attr) and isinstance(getattr(d, attr), date):
+            value = getattr(d, attr)
+            flat_attr[attr] = str(
+                datetime(value.year, value.month, value.day, tzinfo=pytz.UTC)
+            )
+        elif hasattr(d, attr) and isinstance(getattr(d, attr), braintree_objects):
+            flat_attr[attr] = legacy_object_to_dict(
+                braintree_objects, getattr(d, attr), ignore_obj
+            )
+        elif hasattr(d, attr):
+            flat_attr[attr] = getattr(d, attr)
+        else:
+            return
+
+    flat_attr = flatten(flat_attr, root_keys_to_ignore=ignore_obj)
+    flat_attr.update(array_attr)
+
+    return flat_attr
+
+
+def make_transaction(i=0):
+    created_at = datetime(2021, 3, 4, 5, 6, 7)
+    return braintree.Transaction(
+        None,
+        {
+            "id": f"tx{i}",
+            "global_id": f"dHJhbnNhY3Rpb25f{i}",
+            "amount": "12.50",
+            "tax_amount": "0.00",
+            "status": "settled",
+            "created_at": created_at,
+            "updated_at": created_at,
+            "authorization_expires_at": None,
+            "refund_ids": [],
+            "refund_global_ids": ["a", "b"],
+            "custom_fields": {"plan_id": "monthly", "email": ""},
+            "billing": {"country_code_alpha2": None, "region": "", "id": None},
+            "customer": {"id": f"cus{i}", "email": "x@example.com", "phone": None},
+            "credit_card": {"bin": "411111", "card_type": "Visa", "venmo_sdk": False},
+            "descriptor": {"name": "ACME*STORE", "phone": None, "url": None},
+            "disbursement_details": {
+                "disbursement_date": date(2021, 3, 6),
+                "settlement_amount": "12.50",
+                "settlement_currency_exchange_rate": "1",
+                "funds_held": False,
+            },
+            "risk_data": {"id": "r1", "decision": "Approve", "decision_reasons": ["x"]},
+            "add_ons": [{"id": "SaaS_TAX", "name": "SaaS_TAX", "amount": "1.25"}],
+            "discounts": [
+                {"id": "d1", "amount": "2.00", "updated_at": created_at, "name": None}
+            ],
+            "status_history": [
+                {"status": "authorized", "amount": "12.50", "timestamp": created_at},
+                {"status": "settled", "amount": "12.50", "timestamp": created_at},
+            ],
+            "disputes": [
+                {
+                    "id": "dp1",
+                    "amount": "12.50",
+                    "received_date": date(2021, 4, 1),
+                    "status_history": [{"status": "open", "timestamp": created_at}],
+                    "evidence": [{"id": "e1", "comment": "", "created_at": created_at}],
+                    "transaction": {"id": f"tx{i}", "amount": "12.50"},
+                }
+            ],
+        },
+    )
+
+
+def make_customer():
+    return braintree.Customer(
+        None,
+        {
+            "id": "cus1",
+            "email": "x@example.com",
+            "created_at": datetime(2020, 1, 1),
+            "custom_fields": "",
+            "addresses": [
+                {"id": "a1", "country_code_alpha2": None, "region": "X"},
+                {
+                    "id": "a2",
+                    "country_code_alpha2": "US",
+                    "region": "CA",
+                    "created_at": datetime(2020, 1, 1),
+                },
+            ],
+        },
+    )
+
+
+def make_subscription():
+    return braintree.Subscription(
+        None,
+        {
+            "id": "sub1",
+            "price": "9.99",
+            "balance": "0.00",
+            "next_billing_date": date(2021, 4, 4),
+            "descriptor": {"name": "ACME*STORE"},
+            "add_ons": [],
+            "discounts": [{"id": "d1", "amount": "1.00"}],
+            "status_history": [
+                {
+                    "status": "Active",
+                    "balance": "0.00",
+                    "price": "9.99",
+                    "timestamp": datetime(2021, 1, 1),
+                }
+            ],
+            "transactions": [{"id": "tx1", "amount": "9.99", "status": "settled"}],
+        },
+    )
+
+
+def test_serializer_matches_legacy_output():
+    stream, _ = get_stream("transactions")
+    serializer = RecordSerializer(stream.braintree_objects)
+    for ignore in ({"transactions"}, {"transactions", "customer", "amount"}):
+        for obj in (make_transaction(), make_customer(), make_subscription()):
+            # Run twice so the second pass goes through the cached plans.
+            for _ in range(2):
+                expected = legacy_object_to_dict(stream.braintree_objects, obj, ignore)
+                actual = serializer.to_dict(obj, ignore)
+                assert json.dumps(actual, default=repr) == json.dumps(
+                    expected, default=repr
+                )
+
+
+def test_serializer_returns_none_for_missing_attributes():
+    stream, _ = get_stream("transactions")
+    serializer = RecordSerializer(stream.braintree_objects)
+    transaction = make_transaction()
+    transaction._setattrs.append("missing")
+    assert serializer.to_dict(transaction, {"transactions"}) is None
+
+    transaction = make_transaction()
+    transaction.descriptor._setattrs.append("missing")
+    expected = legacy_object_to_dict(
+        stream.braintree_objects, transaction, {"transactions"}
+    )
+    assert serializer.to_dict(transaction, {"transactions"}) == expected
+
+
+def test_parse_record_skips_deselected_properties():
+    catalog = TapBraintree(config=SAMPLE_CONFIG).catalog_dict
+    deselected = {"disputes", "status_history", "discounts", "customer_id"}
+    for entry in catalog["streams"]:
+        for metadata in entry["metadata"]:
+            if metadata["breadcrumb"][-1:] and metadata["breadcrumb"][-1] in deselected:
+                metadata["metadata"]["selected"] = False
+    stream = TapBraintree(config=SAMPLE_CONFIG, catalog=catalog).streams[
+        "transactions"
+    ]
+    transaction = make_transaction()
+
+    parsed = stream.object_to_dict(
+        transaction, {"transactions"}, projection=stream.selected_properties
+    )
+    full = stream.object_to_dict(transaction, {"transactions"})
+
+    assert "disputes" not in parsed and "status_history" not in parsed
+    # customer_id is needed for the billing backfill even when deselected.
+    assert "customer_id" in stream.selected_properties
+    for name in stream.selected_properties:
+        assert parsed.get(name) == full.get(name)
+
+
+def test_catalog_items_are_converted_once():
+    stream, _ = get_stream("subscriptions")
+    catalog = CatalogIndex(
+        discounts=[braintree.Discount(None, {"id": "d1", "amount": "1.00"})]
+    )
+    serializer = RecordSerializer(stream.braintree_objects, catalog=catalog)
+    plain = RecordSerializer(stream.braintree_objects)
+    for obj in (make_transaction(), make_subscription(), make_subscription()):
+        assert serializer.to_dict(obj, {"transactions"}) == plain.to_dict(
+            obj, {"transactions"}
+        )
+    assert len(serializer._converted) == 2
+
+    first, second = (
+        serializer.to_dict(make_subscription(), {"transactions"})["discounts"][0]
+        for _ in range(2)
+    )
+    assert first == second and first is not second
+
+
+def test_timestamps_match_pytz_formatting():
+    serializer = RecordSerializer(())
+    values = [
+        datetime(2021, 3, 4, 5, 6, 7),
+        datetime(2021, 3, 4, 5, 6, 7, 89),
+        datetime(2021, 3, 4, 5, 6, 7, tzinfo=pytz.timezone("Europe/London")),
+        date(2021, 3, 6),
+    ]
+    for value in values * 2:
+        if isinstance(value, datetime):
+            expected = str(value.replace(tzinfo=pytz.UTC))
+        else:
+            expected = str(
+                datetime(value.year, value.month, value.day, tzinfo=pytz.UTC)
+            )
+        assert serializer.format_timestamp(value) == expected
+
+
+def test_exact_decimals_keep_their_precision():
+    stream, _ = get_stream("transactions")
+    transaction = make_transaction()
+    transaction.amount = Decimal("12345678901234.1234567")
+
+    record = RecordSerializer(stream.braintree_objects, exact_decimals=True).to_dict(
+        transaction, {"transactions"}
+    )
+
+    assert record["amount"] == Decimal("12345678901234.1234567")
+    message = singer.format_message(singer.RecordMessage("transactions", record))
+    assert '"amount": 12345678901234.1234567' in message
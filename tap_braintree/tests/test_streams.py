@@ -0,0 +1,80 @@
+"""Tests for the stream specific record handling."""
+
+import braintree
+from braintree.attribute_getter import AttributeGetter
+
+from tap_braintree.cache import CustomerAddressCache
+from tap_braintree.tests.test_client import get_stream
+
+
+def transaction(customer_id, country_code_alpha2=None):
+    return AttributeGetter(
+        {
+            "id": f"t-{customer_id}",
+            "amount": 1,
+            "billing": {"country_code_alpha2": country_code_alpha2, "region": None},
+            "customer": {"id": customer_id},
+        }
+    )
+
+
+def customer(customer_id, country_code_alpha2, region):
+    address = AttributeGetter(
+        {"country_code_alpha2": country_code_alpha2, "region": region}
+    )
+    return AttributeGetter({"id": customer_id, "addresses": [address]})
+
+
+def test_billing_backfill_prefetches_customers_per_page(monkeypatch):
+    searches, finds = [], []
+
+    def search(query):
+        searches.append(query.to_param())
+        return [customer("a", "US", "CA"), customer("b", "GB", None)]
+
+    def find(customer_id):
+        finds.append(customer_id)
+        raise braintree.exceptions.NotFoundError()
+
+    stream, _ = get_stream("transactions", customer_prefetch_batch_size=3)
+    monkeypatch.setattr(stream.gateway.customer, "search", search)
+    monkeypatch.setattr(stream.gateway.customer, "find", find)
+
+    records = [transaction(customer_id) for customer_id in "abaccb"]
+    parsed = list(stream.parse_records(records))
+
+    assert [record["billing_country_code_alpha2"] for record in parsed] == [
+        "US", "GB", "US", None, None, "GB"
+    ]
+    assert searches == [["a", "b"], ["c"]]
+    assert finds == []
+
+
+def test_customer_cache_is_committed_per_prefetch_and_closed_after_sync(
+    monkeypatch, tmp_path
+):
+    path = tmp_path / "customers.db"
+    stream, _ = get_stream("transactions", customer_cache_path=str(path))
+    monkeypatch.setattr(
+        stream.gateway.customer, "search", lambda query: [customer("a", "US", "CA")]
+    )
+    metrics = []
+    stream._write_metric_log = lambda metric, extra_tags: metrics.append(metric)
+
+    list(stream.parse_records([transaction("a")]))
+    cache = stream.customer_cache
+    # Visible to other runs before the sync is over.
+    other = CustomerAddressCache(path=path)
+    assert other.get("a") == ("US", "CA")
+    other.close()
+
+    list(stream.parse_records([transaction("a")]))
+    assert stream.customer_cache is cache
+    stream._tap.sync_streams = lambda: None
+    stream._tap.sync()
+
+    assert stream._customer_cache is None
+    assert [(m["metric"], m["value"]) for m in metrics] == [
+        ("customer_cache_hits", 2),
+        ("customer_cache_misses", 0),
+    ]
@@ -0,0 +1,324 @@
+"""Tests for syncing the tap's streams in parallel, writing their messages and
+profiling the sync."""
+
+import gzip
+import json
+import os
+import pstats
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import braintree
+import pytest
+from click.testing import CliRunner
+from singer_sdk import Stream, Tap
+
+from tap_braintree.profiler import SamplingProfiler
+from tap_braintree.tap import TapBraintree
+from tap_braintree.tests.fake_braintree import generate_transaction
+from tap_braintree.tests.test_client import SAMPLE_CONFIG
+
+# Discovery in a fresh interpreter, failing if it imported a module only syncs
+# need.
+DISCOVER = f"""
+import sys
+from tap_braintree.tap import TapBraintree
+
+tap = TapBraintree(config={SAMPLE_CONFIG!r}, parse_env_config=False)
+assert len(tap.catalog_dict["streams"]) == 4
+sync_only = {{"braintree", "flatten_json", "tap_braintree.scheduler"}}
+assert not sync_only & set(sys.modules), sync_only & set(sys.modules)
+"""
+
+
+def discover():
+    subprocess.run([sys.executable, "-c", DISCOVER], check=True)
+
+
+def fake_records(key, count):
+    def get_records(context):
+        for i in range(count):
+            time.sleep(0.001)
+            yield {"id": str(i), key: f"2021-01-{i + 1:02d}T00:00:00+00:00"}
+
+    return get_records
+
+
+@pytest.mark.parametrize("fast_output", [False, True])
+def test_parallel_streams_write_ordered_messages(capsys, fast_output):
+    tap = TapBraintree(
+        config={
+            **SAMPLE_CONFIG,
+            "parallel_streams": True,
+            "fast_output": fast_output,
+            "output_buffer_bytes": 512,
+        },
+        parse_env_config=False,
+    )
+    tap.streams["transactions"].get_records = fake_records("updated_at", 20)
+    tap.streams["subscriptions"].get_records = fake_records("updated_at", 10)
+    tap.streams["customers"].get_records = fake_records("created_at", 15)
+    tap.streams["plans"].get_records = fake_records("created_at", 0)
+
+    tap.sync()
+
+    messages = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    seen_schemas = set()
+    emitted = {}
+    for message in messages:
+        if message["type"] == "SCHEMA":
+            seen_schemas.add(message["stream"])
+        elif message["type"] == "RECORD":
+            assert message["stream"] in seen_schemas
+            emitted[message["stream"]] = message["record"]
+        elif message["type"] == "STATE":
+            # Bookmarks never point past the records written before them.
+            for name, state in message["value"]["bookmarks"].items():
+                state = state.get("progress_markers", state)
+                if "replication_key_value" in state:
+                    key = state["replication_key"]
+                    assert state["replication_key_value"] <= emitted[name][key]
+
+    assert [message["type"] for message in messages].count("RECORD") == 45
+    bookmarks = messages[-1]["value"]["bookmarks"]
+    counts = {"transactions": 20, "subscriptions": 10, "customers": 15}
+    for name, count in counts.items():
+        key = bookmarks[name]["replication_key"]
+        assert bookmarks[name]["replication_key_value"] == emitted[name][key]
+        assert emitted[name]["id"] == str(count - 1)
+
+
+def test_fast_output_writes_the_same_messages(capsys):
+    def sync(**config):
+        tap = TapBraintree(config={**SAMPLE_CONFIG, **config}, parse_env_config=False)
+        for name in ("transactions", "subscriptions", "plans"):
+            tap.streams[name].get_records = fake_records("updated_at", 0)
+        tap.streams["customers"].get_records = fake_records("created_at", 30)
+        tap.sync()
+        messages = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        for message in messages:
+            message.pop("time_extracted", None)
+            for state in message.get("value", {}).get("bookmarks", {}).values():
+                state.pop("replication_key_signpost", None)
+        return messages
+
+    expected = sync()
+    assert sync(fast_output=True) == expected
+    assert sync(fast_output=True, exact_decimals=True) == expected
+
+
+def test_batch_messages_announce_files_before_state(capsys, tmp_path):
+    tap = TapBraintree(
+        config={
+            **SAMPLE_CONFIG,
+            "batch_output_dir": str(tmp_path),
+            "batch_max_records": 4,
+        },
+        parse_env_config=False,
+    )
+    for name in ("transactions", "subscriptions", "plans"):
+        tap.streams[name].get_records = fake_records("updated_at", 0)
+    tap.streams["customers"].get_records = fake_records("created_at", 10)
+
+    tap.sync()
+
+    messages = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert "RECORD" not in [message["type"] for message in messages]
+    records, files = [], 0
+    for i, message in enumerate(messages):
+        if message["type"] != "BATCH":
+            continue
+        assert message["stream"] == "customers"
+        assert message["encoding"] == {"format": "jsonl", "compression": "gzip"}
+        for url in message["manifest"]:
+            with gzip.open(url[len("file://"):]) as f:
+                records.extend(json.loads(line) for line in f)
+        files += len(message["manifest"])
+        # The STATE message after the BATCH covers just the records announced.
+        state = messages[i + 1]["value"]["bookmarks"]["customers"]
+        state = state.get("progress_markers", state)
+        assert state["replication_key_value"] == records[-1]["created_at"]
+    # The SDK writes a STATE message after the first record.
+    assert files == 4
+    assert [record["id"] for record in records] == [str(i) for i in range(10)]
+
+
+def test_discovery_does_not_import_sync_dependencies():
+    discover()
+
+
+def test_profiler_writes_samples_of_the_sync(tmp_path):
+    output = tmp_path / "sync.pstats"
+    tap = TapBraintree(
+        config={**SAMPLE_CONFIG, "profile_output": str(output)},
+        parse_env_config=False,
+    )
+    profiler = tap.profiler
+    profiler.interval = 0.001
+
+    def sync_streams():
+        started = time.monotonic()
+        while time.monotonic() - started < 0.2:
+            sum(range(1000))
+
+    tap.sync_streams = sync_streams
+    tap.sync()
+
+    stats = pstats.Stats(str(output))
+    assert any(name == "sync_streams" for _, _, name in stats.stats)
+
+    profiler.write(str(tmp_path / "sync.folded"))
+    lines = (tmp_path / "sync.folded").read_text().splitlines()
+    assert any("sync_streams (" in line for line in lines)
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == sum(
+        profiler.samples.values()
+    )
+
+
+def test_profiler_only_samples_slow_windows():
+    profiler = SamplingProfiler(min_window_seconds=60)
+    assert not profiler.sampling
+    profiler.window_started("transactions")
+    assert not profiler.sampling
+    profiler._windows["transactions"] -= 61
+    assert profiler.sampling
+    profiler.window_finished("transactions")
+    assert not profiler.sampling
+
+
+def test_fast_output_is_faster_than_the_sdk_writer(monkeypatch):
+    """Compares the two writers within one run rather than with a recorded
+    baseline, taking the best of interleaved rounds of each."""
+    pytest.importorskip("orjson")
+    start = datetime(2021, 1, 1, 0, 0, 7)
+
+    def writer(fast_output):
+        tap = TapBraintree(
+            config={**SAMPLE_CONFIG, "fast_output": fast_output},
+            parse_env_config=False,
+        )
+        stream = tap.streams["transactions"]
+        for i in range(20):
+            stream.customer_cache.set(f"cus{i}", ("GB", "London"))
+        records = [
+            stream.parse_record(
+                braintree.Transaction(
+                    None, generate_transaction(i, start + timedelta(minutes=i), 20)
+                )
+            )
+            for i in range(200)
+        ]
+
+        def run():
+            started = time.perf_counter()
+            for record in records:
+                stream._write_record_message(dict(record))
+            tap.flush_messages()
+            return time.perf_counter() - started
+
+        return run
+
+    sdk, fast = writer(False), writer(True)
+    with open(os.devnull, "w") as devnull:
+        monkeypatch.setattr("sys.stdout", devnull)
+        rounds = [(sdk(), fast()) for _ in range(6)]
+    sdk_seconds = min(seconds for seconds, _ in rounds[1:])
+    fast_seconds = min(seconds for _, seconds in rounds[1:])
+    assert sdk_seconds >= fast_seconds * 1.2
+
+
+def test_private_sdk_methods_exist():
+    """The private SDK methods the tap calls or overrides. If this fails after
+    upgrading singer-sdk, move the tap to what replaced them."""
+    for name in (
+        "_reset_state_progress_markers",
+        "_set_compatible_replication_methods",
+    ):
+        assert callable(getattr(Tap, name, None)), name
+    for name in (
+        "_write_schema_message",
+        "_write_record_message",
+        "_write_state_message",
+    ):
+        assert callable(getattr(Stream, name, None)), name
+
+
+def test_taps_do_not_share_locks():
+    first = TapBraintree(config=SAMPLE_CONFIG, parse_env_config=False)
+    second = TapBraintree(config=SAMPLE_CONFIG, parse_env_config=False)
+    with first.message_lock:
+        assert second.message_lock.acquire(blocking=False)
+        second.message_lock.release()
+    assert first._setup_lock is not second._setup_lock
+    assert first._catalog_lock is not second._catalog_lock
+
+
+def test_parallel_streams_close_the_customer_cache_on_their_thread(
+    capsys, tmp_path
+):
+    tap = TapBraintree(
+        config={
+            **SAMPLE_CONFIG,
+            "parallel_streams": True,
+            "fast_output": True,
+            "customer_cache_path": str(tmp_path / "customers.db"),
+        },
+        parse_env_config=False,
+    )
+    transactions = tap.streams["transactions"]
+    fetch = fake_records("updated_at", 5)
+
+    def get_records(context):
+        transactions.customer_cache.set("cus1", ("GB", "London"))
+        yield from fetch(context)
+
+    transactions.get_records = get_records
+    for name in ("subscriptions", "customers", "plans"):
+        tap.streams[name].get_records = fake_records("created_at", 0)
+
+    tap.sync()
+
+    messages = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [message["type"] for message in messages].count("RECORD") == 5
+    assert transactions._customer_cache is None
+
+
+def test_sync_tear_down_runs_every_step(capsys):
+    tap = TapBraintree(
+        config={**SAMPLE_CONFIG, "fast_output": True}, parse_env_config=False
+    )
+    for name in ("transactions", "subscriptions", "plans"):
+        tap.streams[name].get_records = fake_records("updated_at", 0)
+    tap.streams["customers"].get_records = fake_records("created_at", 3)
+    closed = []
+
+    def finish_sync():
+        raise RuntimeError("finish_sync failed")
+
+    tap.streams["transactions"].finish_sync = finish_sync
+    tap.close_process_pool = lambda: closed.append(True)
+
+    with pytest.raises(RuntimeError):
+        tap.sync()
+
+    assert closed == [True]
+    messages = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [message["type"] for message in messages].count("RECORD") == 3
+
+
+def test_cli_syncs_through_sync(monkeypatch, tmp_path):
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps(SAMPLE_CONFIG))
+    synced = []
+    monkeypatch.setattr(TapBraintree, "sync", lambda tap: synced.append(tap))
+
+    result = CliRunner().invoke(TapBraintree.cli, ["--config", str(config)])
+
+    assert result.exit_code == 0, result.output
+    assert len(synced) == 1 and synced[0].config["merchant_id"] == "merchant"
+
+    result = CliRunner().invoke(TapBraintree.cli, ["--about", "--format", "json"])
+    assert json.loads(result.output)["name"] == "tap-braintree"
+    assert len(synced) == 1